@@ -0,0 +1,164 @@
+"""
+Answer cache for /ask and /summary (and their streaming / WebSocket variants).
+
+Entries are keyed by the normalized question, a fingerprint of the realtime
+session configuration (prompt, tools, voice, modalities) and the data version
+of the events table, so a new event or a prompt change never serves a stale
+answer. The cache is an LRU with a TTL; a hit is answered without touching the
+realtime connection.
+"""
+import hashlib
+import json
+import os
+import time
+from collections import Counter, OrderedDict
+
+from dotenv import load_dotenv
+
+from audio_manager import get_audio_manager
+from database import data_version
+from intent_router import normalize
+from openai_socket import MODALITIES, SYSTEM_PROMPT, tool_specification
+from state import State
+
+load_dotenv()
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "128"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "600"))
+# Also keep the synthesized audio, so a hit can be replayed on the hub speaker.
+ANSWER_CACHE_AUDIO = os.getenv("ANSWER_CACHE_AUDIO", "true").lower() in ("1", "true", "yes")
+# Total audio kept across entries. Least recently used entries lose their
+# audio (not their text) first; a clip larger than this is never kept.
+ANSWER_CACHE_AUDIO_MAX_BYTES = int(os.getenv("ANSWER_CACHE_AUDIO_MAX_BYTES", str(16 * 1024 * 1024)))
+# The data version query is reused for this many seconds, so bursts of
+# requests cost one lookup.
+DATA_VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", "2"))
+
+SESSION_FINGERPRINT = hashlib.sha1(json.dumps(
+    [SYSTEM_PROMPT, MODALITIES, os.getenv("VOICE", "ash"), os.getenv("MODEL"), tool_specification],
+    sort_keys=True,
+).encode()).hexdigest()[:12]
+
+
+class CachedAnswer:
+    __slots__ = ("created_at", "text", "pcm_data", "media_paths")
+
+    def __init__(self, text, pcm_data=b"", media_paths=None):
+        self.created_at = time.monotonic()
+        self.text = text
+        self.pcm_data = pcm_data
+        self.media_paths = media_paths or []
+
+
+class AnswerCache:
+    def __init__(self, max_entries=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, max_audio_bytes=ANSWER_CACHE_AUDIO_MAX_BYTES):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_audio_bytes = max_audio_bytes
+        self._entries = OrderedDict()
+        self._audio_bytes = 0
+        self._data_version = (0.0, None)
+        self.counters = Counter()
+
+    def _current_data_version(self):
+        checked_at, version = self._data_version
+        if version is None or time.monotonic() - checked_at > DATA_VERSION_TTL:
+            version = data_version()
+            self._data_version = (time.monotonic(), version)
+        return version
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def key(self, question):
+        """
+        Cache key for `question`, or None when the cache is disabled or the data
+        version is unknown. May query the database.
+        """
+        if not self.enabled:
+            return None
+        version = self._current_data_version()
+        if version is None:
+            return None
+        return (normalize(question), SESSION_FINGERPRINT, version)
+
+    def get(self, key):
+        if key is None or self.max_entries <= 0:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        if time.monotonic() - entry.created_at > self.ttl:
+            self._remove(key)
+            self.counters["expired"] += 1
+            self.counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.counters["hits"] += 1
+        return entry
+
+    def put(self, key, text, pcm_data=b"", media_paths=None):
+        if key is None or self.max_entries <= 0 or not text:
+            return
+        if not ANSWER_CACHE_AUDIO or len(pcm_data) > self.max_audio_bytes:
+            pcm_data = b""
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CachedAnswer(text, pcm_data, list(media_paths or []))
+        self._audio_bytes += len(pcm_data)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.counters["evicted"] += 1
+        # Over the audio budget: drop audio from the least recently used entries.
+        for entry in self._entries.values():
+            if self._audio_bytes <= self.max_audio_bytes:
+                break
+            if entry.pcm_data:
+                self._audio_bytes -= len(entry.pcm_data)
+                entry.pcm_data = b""
+                self.counters["audio_dropped"] += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._audio_bytes -= len(entry.pcm_data)
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "entries": len(self._entries),
+            "audio_bytes": self._audio_bytes,
+            "hit_rate": self.counters["hits"] / lookups if lookups else None,
+        }
+
+
+cache = AnswerCache()
+
+
+def replay(entry, play_audio=True):
+    """Restore a cached answer's media paths and, if requested, replay its audio."""
+    state = State()
+    state.last_media_paths = list(entry.media_paths)
+    if not play_audio or not entry.pcm_data:
+        # e.g. a summary hit: must not open the sound device
+        return
+    audio = get_audio_manager()
+    if audio is not None:
+        audio.play(entry.pcm_data)
+
+
+def store(key):
+    """
+    Cache the answer of the turn that just finished in State, unless the turn
+    was cancelled (the answer is partial) or one of its tool calls failed or
+    was rejected (the answer may be an apology).
+    """
+    state = State()
+    if key is None or state.turn_cancelled:
+        return
+    if state.turn_tool_failed:
+        cache.counters["not_stored_tool_failed"] += 1
+        return
+    cache.put(key, state.text.strip(), state.last_pcm_data, state.last_media_paths)
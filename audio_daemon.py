@@ -0,0 +1,128 @@
+"""
+Standalone audio engine: owns the sound device, wakeword, VAD and playback, and
+serves them to API workers over audio_ipc (shared-memory PCM rings plus a Unix
+socket control channel). Run it once per hub, then start the API with
+AUDIO_MODE=daemon and as many workers as needed:
+
+    python audio_daemon.py
+    AUDIO_MODE=daemon uvicorn web_demo:app --host 0.0.0.0 --port 8000 --workers 4
+"""
+import asyncio
+import json
+import os
+
+from audio_ipc import (
+    AUDIO_DAEMON_SOCKET,
+    AUDIO_RECORD_RING_BYTES,
+    AUDIO_RECORD_SEGMENT,
+    PcmRing,
+    encode_message,
+)
+from audio_manager import AudioManager
+
+
+class AudioDaemon:
+    def __init__(self):
+        # Constructed inside the running loop, so the audio thread's events
+        # are delivered to it (see AudioManager._signal).
+        self.audio = AudioManager()
+        self.record_ring = PcmRing(AUDIO_RECORD_SEGMENT, AUDIO_RECORD_RING_BYTES, create=True)
+        self.playback_rings = {}
+        self.subscribers = set()
+        # Workers asking to record while a recording is in progress share it,
+        # rather than restarting the session under each other.
+        self._recording = None
+
+    async def watch_wakeword(self):
+        while True:
+            await self.audio.wake_event.wait()
+            self.audio.wake_event.clear()
+            _, played_samples = self.audio.take_barge_in()
+            message = encode_message({"event": "wakeword", "played_samples": played_samples})
+            for writer in list(self.subscribers):
+                try:
+                    writer.write(message)
+                    await writer.drain()
+                except ConnectionError:
+                    self.subscribers.discard(writer)
+
+    async def _record(self, timeout):
+        recorded = await self.audio.record(timeout)
+        if recorded is None:
+            return {"ok": True, "offset": None, "length": None}
+        offset = self.record_ring.write(recorded)
+        return {"ok": True, "offset": offset, "length": min(len(recorded), self.record_ring.capacity)}
+
+    async def record(self, timeout):
+        if self._recording is None or self._recording.done():
+            self._recording = asyncio.create_task(self._record(timeout))
+        return await asyncio.shield(self._recording)
+
+    def play(self, segment, offset, length):
+        ring = self.playback_rings.get(segment)
+        if ring is None:
+            ring = self.playback_rings[segment] = PcmRing(segment)
+        pcm24k = ring.read(offset, length)
+        if pcm24k is None:
+            return {"ok": False, "error": "playback audio was overwritten before it was read"}
+        self.audio.play(pcm24k)
+        return {"ok": True}
+
+    async def status(self):
+        return {
+            "ok": True,
+            "playing": not self.audio.play_q.empty(),
+            "played_samples": self.audio.played_samples,
+            "subscribers": len(self.subscribers),
+            "playback_segments": list(self.playback_rings),
+            "wakeword": await self.audio.wakeword_stats(),
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                request = json.loads(line)
+                cmd = request.get("cmd")
+                if cmd == "subscribe":
+                    self.subscribers.add(writer)
+                    continue
+                if cmd == "record":
+                    reply = await self.record(request.get("timeout", 20))
+                elif cmd == "play":
+                    try:
+                        reply = self.play(request["segment"], request["offset"], request["length"])
+                    except FileNotFoundError:
+                        reply = {"ok": False, "error": f"no playback segment {request['segment']}"}
+                elif cmd == "stop_playback":
+                    reply = {"ok": True, "played_samples": await self.audio.interrupt_playback()}
+                elif cmd == "status":
+                    reply = await self.status()
+                else:
+                    reply = {"ok": False, "error": f"unknown command {cmd!r}"}
+                writer.write(encode_message(reply))
+                await writer.drain()
+        except (ConnectionError, json.JSONDecodeError) as e:
+            print(f"Audio client error: {e}")
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+    async def serve(self):
+        if os.path.exists(AUDIO_DAEMON_SOCKET):
+            os.unlink(AUDIO_DAEMON_SOCKET)
+        server = await asyncio.start_unix_server(self.handle, path=AUDIO_DAEMON_SOCKET)
+        print(f"Audio daemon listening on {AUDIO_DAEMON_SOCKET}")
+        try:
+            async with server:
+                await asyncio.gather(server.serve_forever(), self.watch_wakeword())
+        finally:
+            self.record_ring.close()
+            for ring in self.playback_rings.values():
+                ring.close()
+
+
+if __name__ == "__main__":
+    async def main():
+        await AudioDaemon().serve()
+
+    asyncio.run(main())
@@ -0,0 +1,233 @@
+"""
+IPC between the audio daemon (audio_daemon.py) and API workers.
+
+PCM travels through shared-memory ring buffers; everything else is a
+newline-delimited JSON control channel over a Unix socket:
+
+    {"cmd": "record", "timeout": 20}         -> {"ok": true, "offset": n, "length": n} | {"ok": true, "length": null}
+    {"cmd": "play", "segment": "...", "offset": n, "length": n}
+    {"cmd": "stop_playback"}                 -> {"ok": true, "played_samples": n | null}
+    {"cmd": "status"}
+    {"cmd": "subscribe"}                     -> one {"event": "wakeword", "played_samples": n | null} per wakeword
+
+Each ring has a single writer: the daemon writes recordings into
+AUDIO_RECORD_SEGMENT, and every worker writes its playback audio into its own
+segment. A reader gets (offset, length) over the control channel and copies
+the bytes out; the copy is rejected if the writer has lapped it since.
+"""
+import asyncio
+import atexit
+import json
+import os
+import struct
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+from dotenv import load_dotenv
+
+from state import Singleton
+
+load_dotenv()
+
+AUDIO_DAEMON_SOCKET = os.getenv("AUDIO_DAEMON_SOCKET", "/tmp/jupyter_audio.sock")
+AUDIO_RECORD_SEGMENT = os.getenv("AUDIO_RECORD_SEGMENT", "jupyter_audio_record")
+# 48 kHz PCM16 mono: 2 MB is ~20 s of recording, 8 MB ~85 s of playback.
+AUDIO_RECORD_RING_BYTES = int(os.getenv("AUDIO_RECORD_RING_BYTES", str(2 * 1024 * 1024)))
+AUDIO_PLAYBACK_RING_BYTES = int(os.getenv("AUDIO_PLAYBACK_RING_BYTES", str(8 * 1024 * 1024)))
+# Control requests (play, stop_playback, status) give up after this long.
+AUDIO_IPC_TIMEOUT = float(os.getenv("AUDIO_IPC_TIMEOUT", "2"))
+
+_HEADER = struct.Struct("<Q")  # total bytes ever written
+
+
+class PcmRing:
+    """
+    Byte ring buffer in a SharedMemory segment. Offsets are absolute (total
+    bytes written), so a reader can tell whether its data has been overwritten.
+    """
+    def __init__(self, name, size=None, create=False):
+        if create:
+            try:
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=_HEADER.size + size)
+            _HEADER.pack_into(self.shm.buf, 0, 0)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            # Only the creator may unlink the segment; before Python 3.13 the
+            # resource tracker would do it when this (attaching) process exits.
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.name = name
+        self.owner = create
+        self.capacity = self.shm.size - _HEADER.size
+
+    @property
+    def written(self):
+        return _HEADER.unpack_from(self.shm.buf, 0)[0]
+
+    def write(self, data):
+        """Append `data` and return its offset. Data larger than the ring keeps its tail."""
+        data = memoryview(data)[-self.capacity:]
+        offset = self.written
+        start = offset % self.capacity
+        first = min(len(data), self.capacity - start)
+        body = self.shm.buf[_HEADER.size:]
+        body[start:start + first] = data[:first]
+        body[:len(data) - first] = data[first:]
+        _HEADER.pack_into(self.shm.buf, 0, offset + len(data))
+        return offset
+
+    def read(self, offset, length):
+        """Copy `length` bytes from `offset`, or None if they were overwritten."""
+        if self.written - offset > self.capacity:
+            return None
+        start = offset % self.capacity
+        first = min(length, self.capacity - start)
+        body = self.shm.buf[_HEADER.size:]
+        data = bytes(body[start:start + first]) + bytes(body[:length - first])
+        # The writer may have lapped us while copying.
+        if self.written - offset > self.capacity:
+            return None
+        return data
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def encode_message(message):
+    return (json.dumps(message) + "\n").encode()
+
+
+class AudioClient(metaclass=Singleton):
+    """
+    Stand-in for AudioManager in API workers when AUDIO_MODE=daemon: the same
+    interface (wake_event, play, interrupt_playback, take_barge_in, record,
+    wakeword_stats), backed by the audio daemon. Control requests never block
+    the event loop: play() hands its request to a task.
+    """
+    def __init__(self):
+        self.wake_event = asyncio.Event()
+        self._barge_in = None  # (played_samples,) of the last unhandled wakeword
+        self._playback = None
+        self._record_ring = None
+        self._lock = threading.Lock()
+        self._loop = None
+        self._subscriber = None
+        self._requests = set()  # in-flight play requests, referenced until done
+        self._ensure_subscribed()
+
+    def _ensure_subscribed(self):
+        if self._subscriber is not None and not self._subscriber.done():
+            return
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._subscriber = self._loop.create_task(self._subscribe())
+
+    async def _subscribe(self):
+        """Forward the daemon's wakeword events, reconnecting if it restarts."""
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(AUDIO_DAEMON_SOCKET)
+                writer.write(encode_message({"cmd": "subscribe"}))
+                await writer.drain()
+                while line := await reader.readline():
+                    event = json.loads(line)
+                    if event.get("event") == "wakeword":
+                        self._barge_in = (event.get("played_samples"),)
+                        self.wake_event.set()
+                writer.close()
+            except (ConnectionError, FileNotFoundError) as e:
+                print(f"Audio daemon unavailable ({e}), retrying")
+            await asyncio.sleep(1)
+
+    async def _request(self, message):
+        """Request/response on the control socket, bounded by AUDIO_IPC_TIMEOUT."""
+        async with asyncio.timeout(AUDIO_IPC_TIMEOUT):
+            reader, writer = await asyncio.open_unix_connection(AUDIO_DAEMON_SOCKET)
+            try:
+                writer.write(encode_message(message))
+                await writer.drain()
+                return json.loads(await reader.readline() or b"{}")
+            finally:
+                writer.close()
+
+    async def _play_request(self, message):
+        try:
+            reply = await self._request(message)
+            if not reply.get("ok"):
+                print(f"Audio daemon playback failed: {reply.get('error')}")
+        except (OSError, TimeoutError) as e:
+            print(f"Audio daemon playback failed: {e}")
+
+    def play(self, pcm24k: bytes):
+        """Hand 24 kHz model audio to the daemon for playback."""
+        self._ensure_subscribed()
+        with self._lock:
+            if self._playback is None:
+                self._playback = PcmRing(
+                    f"jupyter_audio_play_{os.getpid()}", AUDIO_PLAYBACK_RING_BYTES, create=True
+                )
+                atexit.register(self._playback.close)
+            offset = self._playback.write(pcm24k)
+            length = min(len(pcm24k), self._playback.capacity)
+        task = asyncio.get_running_loop().create_task(self._play_request(
+            {"cmd": "play", "segment": self._playback.name, "offset": offset, "length": length}
+        ))
+        self._requests.add(task)
+        task.add_done_callback(self._requests.discard)
+
+    async def interrupt_playback(self):
+        """Stop playback; returns the samples played if something was playing, else None."""
+        try:
+            return (await self._request({"cmd": "stop_playback"})).get("played_samples")
+        except (OSError, TimeoutError) as e:
+            print(f"Audio daemon stop_playback failed: {e}")
+            return None
+
+    async def wakeword_stats(self):
+        try:
+            return (await self._request({"cmd": "status"})).get("wakeword")
+        except (OSError, TimeoutError) as e:
+            print(f"Audio daemon status failed: {e}")
+            return None
+
+    def take_barge_in(self):
+        self._ensure_subscribed()
+        if self._barge_in is None:
+            return False, None
+        (played_samples,), self._barge_in = self._barge_in, None
+        return True, played_samples
+
+    async def record(self, timeout: int = 20) -> bytes | None:
+        """
+        Record speech on the daemon until silence or timeout; return None if
+        insufficient speech.
+        """
+        self._ensure_subscribed()
+        try:
+            reader, writer = await asyncio.open_unix_connection(AUDIO_DAEMON_SOCKET)
+        except (ConnectionError, FileNotFoundError) as e:
+            print(f"Audio daemon unavailable: {e}")
+            return None
+        try:
+            writer.write(encode_message({"cmd": "record", "timeout": timeout}))
+            await writer.drain()
+            reply = json.loads(await reader.readline() or b"{}")
+        finally:
+            writer.close()
+
+        if not reply.get("length"):
+            return None
+        if self._record_ring is None:
+            self._record_ring = PcmRing(AUDIO_RECORD_SEGMENT)
+        data = self._record_ring.read(reply["offset"], reply["length"])
+        if data is None:
+            print("Recording was overwritten before it could be read")
+        return data
@@ -1,22 +1,29 @@
 import asyncio
 import audioop
-import functools
+import os
 import queue
 import threading
 import time
 from collections import deque
 from typing import Deque
-import openwakeword
 
-import numpy as np
-import sounddevice as sd
-import webrtcvad
 from dotenv import load_dotenv
 from state import Singleton
+from wakeword import WakewordGate, get_wakeword_model
+
+# sounddevice, webrtcvad and openwakeword are imported lazily: importing this
+# module must stay cheap and must not require a sound card, so that headless
+# deployments can still use the constants and helpers below.
 
 # Load environment variables (e.g., for wakeword model paths)
 load_dotenv()
 
+# Text-only deployments: never open the sound device or load the wakeword model.
+HEADLESS = os.getenv("HEADLESS", "false").lower() in ("1", "true", "yes")
+# "local": this process owns the sound device. "daemon": audio_daemon.py owns
+# it and API workers talk to it over IPC (see audio_ipc.py).
+AUDIO_MODE = os.getenv("AUDIO_MODE", "local").lower()
+
 # Audio settings
 RATE = 48_000
 CHUNK_SAMPLES = 1280
@@ -42,15 +49,22 @@ MIN_SPEECH_BYTES    = int(MIN_SPEECH_DURATION * RATE * 2)
 
 # Wakeword detection threshold
 WAKE_THRESHOLD = 0.2
+# Scores stay above the threshold for several consecutive blocks. Only the
+# rising edge counts as a detection, and none within this many seconds of the
+# last one, so a wake recording and its pre-roll are not restarted mid-phrase.
+WAKE_REFRACTORY_SECONDS = 2.0
 
+# Audio kept from before speech is confirmed and prepended to the recording,
+# so the onset of the first word is not clipped.
+PREROLL_MS = int(os.getenv("PREROLL_MS", "300"))
+PREROLL_FRAMES = max(SPEECH_START_MIN_FRAMES, PREROLL_MS // VAD_FRAME_MS)
 
-@functools.lru_cache
-def _load_oww_model():
-    openwakeword.utils.download_models()
-    return openwakeword.Model(
-        wakeword_models=["./hey_jupiter.onnx"],
-        inference_framework="onnx",
-    )
+# Start recording straight from the wakeword detection, instead of waiting for
+# a client to ask for it.
+RECORD_ON_WAKE = os.getenv("RECORD_ON_WAKE", "true").lower() in ("1", "true", "yes")
+# A recording started by the wakeword can be claimed by record_voice_input()
+# while in progress or for this long after it ended.
+WAKE_RECORDING_MAX_AGE = 5.0
 
 
 class AudioManager(metaclass=Singleton):
@@ -62,12 +76,33 @@ class AudioManager(metaclass=Singleton):
         self.play_q: "queue.Queue[bytes]" = queue.Queue()
         self.wake_event = asyncio.Event()
         self.stop_playback_event = threading.Event()
+        # The loop awaiting wake_event and record_done. Both are set from the
+        # sounddevice callback thread, and asyncio.Event.set() from another
+        # thread does not wake an idle loop, so they go through _signal().
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
+
+        # Barge-in: set by the audio thread when the wakeword interrupts a
+        # response, with the number of samples (at RATE) that were actually heard.
+        self.barge_in_event = threading.Event()
+        self.played_samples = 0
+        self.interrupted_at_samples = None
+        # Wakeword edge detection
+        self._wake_above_threshold = False
+        self._last_wake_at = float("-inf")
 
         # Recording state
         self.recording_bytes = bytearray()
         self.record_done = asyncio.Event()
+        self._recording_ended_at = 0.0
+        self._wake_recording = False
+        # Continuous pre-roll of the most recent VAD frames
+        self._preroll: Deque[bytes] = deque(maxlen=PREROLL_FRAMES)
 
         # VAD internals
+        import webrtcvad
         self._vad = webrtcvad.Vad(1)
         self._vad_buffer = bytearray()
         self._vad_ring: Deque[bool] = deque(
@@ -90,13 +125,68 @@ class AudioManager(metaclass=Singleton):
     def play(self, pcm24k: bytes):
         """Enqueue resampled 16k audio for playback."""
         pcm16k, _ = audioop.ratecv(pcm24k, 2, 1, 24_000, RATE, None)
+        self.stop_playback_event.clear()
+        self.played_samples = 0
         for i in range(0, len(pcm16k), CHUNK_BYTES):
             self.play_q.put_nowait(pcm16k[i:i + CHUNK_BYTES])
 
-    def start_recording(self):
+    async def interrupt_playback(self):
+        """
+        Stop playback. Returns the number of samples (at RATE) that were played
+        if something was playing, otherwise None.
+        """
+        played_samples = self.played_samples if not self.play_q.empty() else None
+        self.stop_playback_event.set()
+        return played_samples
+
+    def take_barge_in(self):
+        """
+        Return (interrupted, played_samples) for a wakeword that fired since
+        the last call, and reset it.
+        """
+        if not self.barge_in_event.is_set():
+            return False, None
+        self.barge_in_event.clear()
+        played_samples, self.interrupted_at_samples = self.interrupted_at_samples, None
+        return True, played_samples
+
+    async def record(self, timeout: int = 20) -> bytes | None:
+        """
+        Record speech until silence or timeout; return None if insufficient speech.
+        """
+        # Continue the session the wakeword already started, if there is one.
+        if not self.claim_wake_recording():
+            self.start_recording()
+        self._loop = self._loop or asyncio.get_running_loop()
+
+        async def finished():
+            # A set() scheduled by the audio thread for an earlier session can
+            # land after start_recording() cleared the event; ignore it.
+            while True:
+                await self.record_done.wait()
+                if not self._is_recording:
+                    return
+                self.record_done.clear()
+
+        try:
+            await asyncio.wait_for(finished(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.no_speech = True
+
+        if self.no_speech or len(self.recording_bytes) < MIN_SPEECH_BYTES:
+            return None
+        return bytes(self.recording_bytes)
+
+    async def wakeword_stats(self):
+        """Blocks scored vs. skipped by the wakeword gate, for /stats."""
+        gate = getattr(self, "wakeword_gate", None)
+        return gate.stats() if gate else None
+
+    def start_recording(self, from_wake=False):
         """Begin VAD-based recording session."""
+        self._wake_recording = from_wake
         self.recording_bytes.clear()
-        self.record_done.clear()
+        self._signal(self.record_done.clear)
         self._is_recording = True
         self._speech_started = False
         self._recording_started_at = time.monotonic()
@@ -104,7 +194,44 @@ class AudioManager(metaclass=Singleton):
         self._start_ring.clear()
         self.no_speech = False
 
+    def claim_wake_recording(self):
+        """
+        Take over the recording session the wakeword started, if there is a
+        recent one nobody has claimed yet. Returns False if the caller should
+        start its own recording.
+        """
+        recent = self._is_recording or time.monotonic() - self._recording_ended_at < WAKE_RECORDING_MAX_AGE
+        claimed = self._wake_recording and recent
+        self._wake_recording = False
+        return claimed
+
+    def _signal(self, set_or_clear):
+        """
+        Run an asyncio.Event set()/clear() on the loop that awaits it. From the
+        loop itself it runs directly; from the audio thread it is scheduled
+        with call_soon_threadsafe, which wakes the loop and keeps set/clear
+        calls in order.
+        """
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if self._loop is None or on_loop:
+            set_or_clear()
+        else:
+            self._loop.call_soon_threadsafe(set_or_clear)
+
+    def _finish_recording(self):
+        self._is_recording = False
+        self._recording_ended_at = time.monotonic()
+        self._signal(self.record_done.set)
+
     def _run_stream(self):
+        import sounddevice as sd
+
+        # Load the wakeword model before the stream starts, so the first audio
+        # callback does not stall on it and overflow the input buffer.
+        self.wakeword_gate = WakewordGate(get_wakeword_model(), WAKE_THRESHOLD, RATE)
         stream = sd.RawStream(
             samplerate=RATE,
             channels=1,
@@ -122,12 +249,21 @@ class AudioManager(metaclass=Singleton):
 
     def _callback(self, in_data, out_data, frames, time_info, status):
         pcm_in = memoryview(in_data)
-        # Wakeword detection
-        mdl = _load_oww_model()
-        mdl.predict(np.frombuffer(pcm_in, dtype=np.int16))
-        if any(buf and buf[-1] > WAKE_THRESHOLD for buf in mdl.prediction_buffer.values()):
-            self.wake_event.set()
+        # Wakeword detection (skipped on silent blocks if WAKEWORD_GATE is set)
+        above_threshold = self.wakeword_gate.score(pcm_in)
+        rising_edge = above_threshold and not self._wake_above_threshold
+        self._wake_above_threshold = above_threshold
+        if rising_edge and time.monotonic() - self._last_wake_at > WAKE_REFRACTORY_SECONDS:
+            self._last_wake_at = time.monotonic()
+            self._signal(self.wake_event.set)
+            if not self.play_q.empty():
+                self.interrupted_at_samples = self.played_samples
             self.stop_playback_event.set()
+            self.barge_in_event.set()
+            if RECORD_ON_WAKE:
+                # Everything before this point is the wake phrase itself.
+                self._preroll.clear()
+                self.start_recording(from_wake=True)
 
         # VAD processing
         self._vad_buffer.extend(pcm_in)
@@ -135,6 +271,7 @@ class AudioManager(metaclass=Singleton):
             frame = self._vad_buffer[:VAD_FRAME_BYTES]
             del self._vad_buffer[:VAD_FRAME_BYTES]
             is_speech = self._vad.is_speech(frame, RATE)
+            self._preroll.append(bytes(frame))
 
             if self._is_recording:
                 # Before speech start: buffer recent decisions
@@ -143,13 +280,16 @@ class AudioManager(metaclass=Singleton):
                     # require several consecutive true detections
                     if len(self._start_ring) == self._start_ring.maxlen and all(self._start_ring):
                         self._speech_started = True
-                        self.recording_bytes.clear()
+                        # start from the pre-roll (which includes this frame)
+                        # rather than from the frame that confirmed speech
+                        self.recording_bytes[:] = b"".join(self._preroll)
                         self._vad_ring.clear()
+                        self._vad_ring.append(is_speech)
+                        continue
                     # timeout waiting for speech
                     elif time.monotonic() - self._recording_started_at > SPEECH_START_TIMEOUT:
                         self.no_speech = True
-                        self._is_recording = False
-                        self.record_done.set()
+                        self._finish_recording()
                         continue
 
                 # Once started, collect and detect end
@@ -161,8 +301,7 @@ class AudioManager(metaclass=Singleton):
                     if len(self._vad_ring) == MAX_SILENCE_FRAMES and not any(self._vad_ring):
                         if len(self.recording_bytes) < MIN_SPEECH_BYTES:
                             self.no_speech = True
-                        self._is_recording = False
-                        self.record_done.set()
+                        self._finish_recording()
 
         # Playback handling
         if self.stop_playback_event.is_set():
@@ -176,22 +315,36 @@ class AudioManager(metaclass=Singleton):
         except queue.Empty:
             out_data[:] = b"\x00" * CHUNK_BYTES
         else:
+            self.played_samples += len(chunk) // 2
             if len(chunk) < CHUNK_BYTES:
                 chunk += b"\x00" * (CHUNK_BYTES - len(chunk))
             out_data[:CHUNK_BYTES] = chunk
 
 
+def get_audio_manager(create=True):
+    """
+    Return the shared AudioManager, constructing it (and opening the sound
+    device) on first use. Returns None in HEADLESS mode, or when `create` is
+    False and nothing has started the audio subsystem yet.
+
+    With AUDIO_MODE=daemon the sound device belongs to audio_daemon.py and an
+    AudioClient with the same interface is returned instead.
+    """
+    if HEADLESS:
+        return None
+    if AUDIO_MODE == "daemon":
+        from audio_ipc import AudioClient
+        return AudioClient()
+    if not create and AudioManager not in Singleton._instances:
+        return None
+    return AudioManager()
+
+
 async def record_voice_input(timeout: int = 20) -> bytes | None:
     """
     Record speech until silence or timeout; return None if insufficient speech.
     """
-    audio = AudioManager()
-    audio.start_recording()
-    try:
-        await asyncio.wait_for(audio.record_done.wait(), timeout=timeout)
-    except asyncio.TimeoutError:
-        audio.no_speech = True
-
-    if audio.no_speech or len(audio.recording_bytes) < MIN_SPEECH_BYTES:
+    audio = get_audio_manager()
+    if audio is None:
         return None
-    return bytes(audio.recording_bytes)
+    return await audio.record(timeout)
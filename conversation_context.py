@@ -0,0 +1,306 @@
+"""
+Rolling compaction of the realtime conversation.
+
+The realtime connection is reused indefinitely, and every turn adds a
+full-length audio item and tool outputs to the server-side context. The
+ConversationContext tracks the items in that context (ids, kind, estimated
+tokens, turn) from the events the server sends. Before each response it
+compacts turns older than CONTEXT_KEEP_TURNS:
+
+- audio items whose transcript is known are replaced by text messages,
+- tool outputs are replaced by a short summary,
+- if the compacted estimate would still be above CONTEXT_MAX_TOKENS, the
+  oldest turns are deleted outright instead.
+
+The input tokens the server reports for every response are kept per turn, so
+/stats shows whether the context stays flat over days of uptime.
+"""
+import json
+import os
+import uuid
+from collections import Counter, deque
+
+from dotenv import load_dotenv
+
+from result_encoder import BYTES_PER_TOKEN
+
+load_dotenv()
+
+CONTEXT_COMPACTION = os.getenv("CONTEXT_COMPACTION", "true").lower() in ("1", "true", "yes")
+# The most recent turns are never compacted.
+CONTEXT_KEEP_TURNS = int(os.getenv("CONTEXT_KEEP_TURNS", "2"))
+# Estimated budget for the whole conversation; older turns are dropped above it.
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "4000"))
+
+# Rough audio token rates of the realtime model, and the speaking rate used to
+# size assistant audio from its transcript.
+INPUT_AUDIO_TOKENS_PER_SECOND = 10
+OUTPUT_AUDIO_TOKENS_PER_SECOND = 20
+SPOKEN_CHARS_PER_SECOND = 15
+# pcm16 at 24 kHz, the session's input_audio_format
+INPUT_AUDIO_BYTES_PER_SECOND = 48_000
+
+SUMMARY_MAX_CHARS = 160
+
+
+def new_item_id():
+    """Client-side item id (the API allows up to 32 characters)."""
+    return "ctx_" + uuid.uuid4().hex[:24]
+
+
+def text_tokens(text):
+    return len((text or "").encode()) // BYTES_PER_TOKEN + 1
+
+
+def audio_tokens(encoded_audio):
+    seconds = len(encoded_audio) * 3 / 4 / INPUT_AUDIO_BYTES_PER_SECOND
+    return int(seconds * INPUT_AUDIO_TOKENS_PER_SECOND) + 1
+
+
+def summarize_tool_output(output):
+    """One-line stand-in for an old tool output."""
+    try:
+        decoded = json.loads(output)
+    except (TypeError, ValueError):
+        decoded = None
+    if isinstance(decoded, dict) and "columns" in decoded:
+        summary = f"{len(decoded.get('rows', []))} rows of {', '.join(decoded['columns']) or 'no columns'}"
+        if decoded.get("truncated"):
+            summary += f" ({decoded['truncated']} not shown)"
+    elif isinstance(decoded, dict) and decoded.get("rejected"):
+        summary = f"query rejected: {decoded.get('reason')}"
+    else:
+        summary = str(output)
+    if len(summary) > SUMMARY_MAX_CHARS:
+        summary = summary[:SUMMARY_MAX_CHARS] + "..."
+    return f"[earlier result, compacted] {summary}"
+
+
+class ContextItem:
+    __slots__ = ("item_id", "kind", "turn", "tokens", "call_id", "transcript", "compacted")
+
+    def __init__(self, item_id, kind, turn, tokens=0, call_id=None, transcript=None):
+        self.item_id = item_id
+        # user_audio | user_text | assistant_audio | assistant_text | function_call | function_call_output
+        self.kind = kind
+        self.turn = turn
+        self.tokens = tokens
+        self.call_id = call_id
+        # audio transcript, or the full output of a function_call_output
+        self.transcript = transcript
+        self.compacted = False
+
+
+class ConversationContext:
+    def __init__(self, keep_turns=CONTEXT_KEEP_TURNS, max_tokens=CONTEXT_MAX_TOKENS):
+        self.keep_turns = keep_turns
+        self.max_tokens = max_tokens
+        self._items = []
+        self._by_id = {}
+        self.turn = 0
+        # audio streamed with input_audio_buffer.append, not yet committed
+        self._pending_audio_tokens = 0
+        # input tokens reported by the server per response, most recent last
+        self.turn_usage = deque(maxlen=50)
+        self.counters = Counter()
+
+    def reset(self):
+        """Forget everything: called when a new realtime session is opened."""
+        self._items.clear()
+        self._by_id.clear()
+        self.turn = 0
+        self._pending_audio_tokens = 0
+        self.turn_usage.clear()
+
+    def begin_turn(self):
+        self.turn += 1
+
+    def audio_appended(self, encoded_audio):
+        self._pending_audio_tokens += audio_tokens(encoded_audio)
+
+    def audio_committed(self):
+        """The committed buffer becomes a user audio item, created by the server."""
+        self.begin_turn()
+
+    def add(self, item_id, kind, tokens=0, call_id=None, transcript=None):
+        item = ContextItem(item_id, kind, self.turn, tokens, call_id, transcript)
+        self._items.append(item)
+        self._by_id[item_id] = item
+        return item
+
+    def tokens(self):
+        return sum(item.tokens for item in self._items)
+
+    def observe(self, event):
+        """Update the tracked items from one server event (a decoded dict)."""
+        event_type = event.get("type")
+        if event_type == "conversation.item.created":
+            item = event.get("item", {})
+            if item.get("id") and item["id"] not in self._by_id:
+                kind, tokens = item.get("type"), 0
+                if any(part.get("type") == "input_audio" for part in item.get("content", [])):
+                    kind, tokens = "user_audio", self._pending_audio_tokens
+                    self._pending_audio_tokens = 0
+                elif kind == "message":
+                    kind = f"{item.get('role')}_text"
+                self.add(item["id"], kind, tokens, call_id=item.get("call_id"))
+        elif event_type == "response.output_item.done":
+            item = event.get("item", {})
+            if not item.get("id"):
+                return
+            tracked = self._by_id.get(item["id"]) or self.add(item["id"], item.get("type"))
+            if item.get("type") == "function_call":
+                tracked.kind = "function_call"
+                tracked.call_id = item.get("call_id")
+                tracked.tokens = text_tokens(item.get("arguments"))
+            elif item.get("type") == "message":
+                for part in item.get("content", []):
+                    if part.get("type") == "audio":
+                        tracked.kind = "assistant_audio"
+                        tracked.transcript = part.get("transcript") or ""
+                        seconds = len(tracked.transcript) / SPOKEN_CHARS_PER_SECOND
+                        tracked.tokens = int(seconds * OUTPUT_AUDIO_TOKENS_PER_SECOND) + 1
+                    elif part.get("type") == "text":
+                        tracked.kind = "assistant_text"
+                        tracked.tokens = text_tokens(part.get("text"))
+        elif event_type == "conversation.item.input_audio_transcription.completed":
+            tracked = self._by_id.get(event.get("item_id"))
+            if tracked is not None:
+                tracked.transcript = event.get("transcript", "")
+        elif event_type == "conversation.item.truncated":
+            # Truncation drops the server-side transcript: the item can only be deleted.
+            tracked = self._by_id.get(event.get("item_id"))
+            if tracked is not None:
+                tracked.transcript = None
+        elif event_type == "conversation.item.deleted":
+            tracked = self._by_id.pop(event.get("item_id"), None)
+            if tracked is not None:
+                self._items.remove(tracked)
+        elif event_type == "response.done":
+            usage = event.get("response", {}).get("usage") or {}
+            if usage:
+                self.turn_usage.append({
+                    "turn": self.turn,
+                    "input_tokens": usage.get("input_tokens"),
+                    "cached_tokens": (usage.get("input_token_details") or {}).get("cached_tokens"),
+                    "estimated_tokens": self.tokens(),
+                    "items": len(self._items),
+                })
+
+    async def _delete(self, websocket, item):
+        await websocket.send(json.dumps({"type": "conversation.item.delete", "item_id": item.item_id}))
+        self._by_id.pop(item.item_id, None)
+        self._items.remove(item)
+
+    async def _replace(self, websocket, item, new_item, tokens):
+        """Insert `new_item` where `item` is, then delete `item`."""
+        index = self._items.index(item)
+        new_item["id"] = new_item_id()
+        await websocket.send(json.dumps({
+            "type": "conversation.item.create",
+            "previous_item_id": self._items[index - 1].item_id if index else "root",
+            "item": new_item,
+        }))
+        await websocket.send(json.dumps({"type": "conversation.item.delete", "item_id": item.item_id}))
+        del self._by_id[item.item_id]
+        item.item_id = new_item["id"]
+        item.tokens = tokens
+        item.compacted = True
+        self._by_id[item.item_id] = item
+
+    async def _compact_item(self, websocket, item):
+        if item.kind == "user_audio":
+            if item.transcript is None:
+                return  # transcript not in yet; try again next turn
+            await self._replace(websocket, item, {
+                "type": "message", "role": "user",
+                "content": [{"type": "input_text", "text": item.transcript}],
+            }, text_tokens(item.transcript))
+            self.counters["audio_replaced"] += 1
+        elif item.kind == "assistant_audio":
+            if not item.transcript:
+                await self._delete(websocket, item)
+                self.counters["items_deleted"] += 1
+                return
+            await self._replace(websocket, item, {
+                "type": "message", "role": "assistant",
+                "content": [{"type": "text", "text": item.transcript}],
+            }, text_tokens(item.transcript))
+            self.counters["audio_replaced"] += 1
+        elif item.kind == "function_call_output":
+            summary = summarize_tool_output(item.transcript)
+            await self._replace(websocket, item, {
+                "type": "function_call_output", "call_id": item.call_id, "output": summary,
+            }, text_tokens(summary))
+            self.counters["tool_outputs_summarized"] += 1
+        else:
+            item.compacted = True
+
+    def _compacted_tokens(self, item):
+        """Estimated size of `item` once compacted."""
+        if item.compacted:
+            return item.tokens
+        if item.kind == "user_audio":
+            return item.tokens if item.transcript is None else text_tokens(item.transcript)
+        if item.kind == "assistant_audio":
+            return text_tokens(item.transcript) if item.transcript else 0
+        if item.kind == "function_call_output":
+            return text_tokens(summarize_tool_output(item.transcript))
+        return item.tokens
+
+    async def compact(self, websocket):
+        """
+        Drop the oldest turns while the context would still be over budget after
+        compaction, then compact the remaining turns older than keep_turns.
+        """
+        if not CONTEXT_COMPACTION:
+            return
+        keep_from = self.turn - self.keep_turns + 1
+        projected = sum(
+            self._compacted_tokens(item) if item.turn < keep_from else item.tokens for item in self._items
+        )
+        while projected > self.max_tokens and self._items and self._items[0].turn < keep_from:
+            oldest = self._items[0].turn
+            for item in [item for item in self._items if item.turn == oldest]:
+                projected -= self._compacted_tokens(item)
+                await self._delete(websocket, item)
+                self.counters["items_deleted"] += 1
+            self.counters["turns_dropped"] += 1
+
+        for item in [item for item in self._items if item.turn < keep_from and not item.compacted]:
+            await self._compact_item(websocket, item)
+
+    def stats(self):
+        """Current context estimate and per-turn input tokens, for the /stats endpoint."""
+        return {
+            "enabled": CONTEXT_COMPACTION,
+            "turn": self.turn,
+            "items": len(self._items),
+            "items_by_kind": dict(Counter(item.kind for item in self._items)),
+            "estimated_tokens": self.tokens(),
+            "max_tokens": self.max_tokens,
+            **self.counters,
+            "turns": list(self.turn_usage),
+        }
+
+
+context = ConversationContext()
+
+
+def user_message_item(content):
+    """Build a tracked user message item from input_text / input_audio parts."""
+    item_id = new_item_id()
+    context.begin_turn()
+    audio = [part["audio"] for part in content if part.get("type") == "input_audio"]
+    if audio:
+        context.add(item_id, "user_audio", sum(audio_tokens(a) for a in audio))
+    else:
+        context.add(item_id, "user_text", sum(text_tokens(part.get("text")) for part in content))
+    return {"id": item_id, "type": "message", "role": "user", "content": content}
+
+
+def function_output_item(call_id, output):
+    """Build a tracked function_call_output item; the output is kept for its summary."""
+    item_id = new_item_id()
+    context.add(item_id, "function_call_output", text_tokens(output), call_id=call_id, transcript=output)
+    return {"id": item_id, "type": "function_call_output", "call_id": call_id, "output": output}
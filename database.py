@@ -1,9 +1,12 @@
 import os
+import time
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from psycopg2 import sql
 
 from dotenv import load_dotenv
+from sql_guard import QueryRejected, SQL_STATEMENT_TIMEOUT_MS, check_plan, check_query
+from workload import record_query
 
 load_dotenv()
 
@@ -20,17 +23,34 @@ DB_TABLE_NAME = os.getenv("DB_TABLE_NAME", "event_event")
 DATA_TIME_WINDOW = os.getenv("DATA_TIME_WINDOW", "30 days")
 
 
-def query_database(query):
+def query_database(query, params=None):
     """
     Connects to the PostgreSQL database and executes the given SQL query.
 
     Parameters:
         sql (str): The SQL query string with placeholders.
+        params (sequence, optional): Values for the %s placeholders.
+
+    The query first goes through the sql_guard checks: it must be a single
+    read-only SELECT, gets a LIMIT if it has none, and is EXPLAINed and refused
+    when the estimated cost is too high. It then runs in a READ ONLY
+    transaction with a statement timeout, and is recorded in the workload
+    store (see workload.py) for the index advisor.
 
     Returns:
         list or dict: A list of records (as dictionaries) if the query succeeds,
-                      or an error message dictionary if the query fails.
+                      a rejection dictionary ({"rejected": True, "reason", "hint", ...})
+                      if the guard refused it, or an error message dictionary if
+                      the query fails.
     """
+    try:
+        query, rewrites = check_query(query)
+    except QueryRejected as e:
+        print(f"Query rejected ({e.reason}): {e.message}")
+        return e.feedback()
+    if rewrites:
+        print(f"Query rewritten: {', '.join(rewrites)}")
+
     try:
         connection = psycopg2.connect(
             host=DB_HOST,
@@ -60,11 +80,57 @@ def query_database(query):
             cursor.close()
             connection.close()
             return {"error": f"Failed to enforce data window: {e}"}
-        cursor.execute(sql.SQL(query))
+        cursor.execute("SET TRANSACTION READ ONLY")
+        cursor.execute("SET LOCAL statement_timeout = %s", [SQL_STATEMENT_TIMEOUT_MS])
+        try:
+            plan = check_plan(cursor, query, params)
+        except QueryRejected as e:
+            print(f"Query rejected ({e.reason}): {e.message}")
+            connection.rollback()
+            cursor.close()
+            connection.close()
+            return e.feedback()
+        started = time.perf_counter()
+        cursor.execute(sql.SQL(query), params)
         results = cursor.fetchall()
+        duration_ms = (time.perf_counter() - started) * 1000
         connection.commit()
         cursor.close()
         connection.close()
+        record_query(query, duration_ms, len(results), plan)
         return results
     except Exception as e:
         return {"error": str(e)}
+
+
+def data_version():
+    """
+    A cheap marker that changes whenever a new event lands in the events table
+    (latest start_time and event count of the last day). Returns None if the
+    database is unreachable.
+    """
+    try:
+        connection = psycopg2.connect(
+            host=DB_HOST,
+            port=DB_PORT,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD
+        )
+        cursor = connection.cursor()
+        cursor.execute(
+            sql.SQL(
+                """
+                SELECT max(start_time), count(*)
+                FROM public.{table_name}
+                WHERE start_time >= now() - interval '1 day'
+                """
+            ).format(table_name=sql.Identifier(DB_TABLE_NAME))
+        )
+        latest, recent = cursor.fetchone()
+        cursor.close()
+        connection.close()
+        return f"{latest}|{recent}"
+    except Exception as e:
+        print(f"Failed to read data version: {e}")
+        return None
@@ -1,14 +1,15 @@
 import numpy as np
-import openwakeword
 
-openwakeword.utils.download_models()
-owwModel = openwakeword.Model(wakeword_models=["./hey_jupiter.onnx"], inference_framework='onnx')
+from wakeword import get_wakeword_model
 
 CHUNK = 1280  # Default chunk size for processing
 
-n_models = len(owwModel.models.keys())
+def get_oww_model():
+    # Loaded on first use rather than at import, downloading the base models is slow.
+    return get_wakeword_model()
 
 def listen_for_hotword(mic_stream):
+    owwModel = get_oww_model()
     # Read CHUNK frames. This returns a tuple (data, overflow_flag)
     mic_stream.start()
     data, overflow = mic_stream.read(CHUNK)
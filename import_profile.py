@@ -0,0 +1,65 @@
+"""
+Import-time profile of the web demo.
+
+Runs `import web_demo` (or another module) in a fresh interpreter with
+`python -X importtime` and prints the wall-clock import time together with the
+slowest modules by cumulative import time.
+
+Usage:
+    HEADLESS=1 python import_profile.py
+    python import_profile.py --module openai_socket --top 30
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def profile_imports(module):
+    """
+    Import `module` in a subprocess and return (wall_seconds, rows), where rows
+    are (cumulative_us, self_us, depth, name) tuples parsed from -X importtime.
+    """
+    code = (
+        "import time; t = time.perf_counter(); "
+        f"import {module}; "
+        "print(time.perf_counter() - t)"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env=os.environ.copy(),
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{proc.stderr[-2000:]}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative_us), int(self_us), depth, name.strip()))
+
+    wall_seconds = float(proc.stdout.strip().splitlines()[-1])
+    return wall_seconds, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile report.")
+    parser.add_argument("--module", default="web_demo", help="module to import (default: web_demo)")
+    parser.add_argument("--top", type=int, default=20, help="number of modules to list")
+    args = parser.parse_args()
+
+    wall_seconds, rows = profile_imports(args.module)
+
+    print(f"import {args.module}: {wall_seconds * 1000:.0f} ms wall clock "
+          f"(HEADLESS={os.getenv('HEADLESS', 'false')})")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, depth, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {'  ' * depth}{name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Local fast path for the handful of question shapes that make up most traffic
+("what happened today", "was there a parcel", "last person at the front door").
+
+route() matches the question against INTENTS, runs the intent's precompiled,
+parameterized query through database.query_database and renders the answer
+from intent_templates.yml. Anything that does not match, or whose query fails,
+returns None and goes to the model as before.
+"""
+import os
+import re
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import yaml
+from dotenv import load_dotenv
+
+from database import DB_TABLE_NAME, query_database
+
+load_dotenv()
+
+INTENT_ROUTER = os.getenv("INTENT_ROUTER", "true").lower() in ("1", "true", "yes")
+TEMPLATE_FILE = os.getenv("INTENT_TEMPLATES_FILE", "intent_templates.yml")
+with open(TEMPLATE_FILE, "r") as file:
+    intent_templates = yaml.safe_load(file)
+
+# Questions that mention any other time frame are left to the model.
+_OTHER_TIMEFRAME = re.compile(
+    r"\b(yesterday|week|month|year|night|morning|afternoon|evening|hours?|minutes?|ago|since|between|before|after|until)\b"
+)
+_WAKE_PREFIX = re.compile(r"^(hey|hi|ok|okay)?\s*(jupyter|jupiter)\s*")
+
+_LABELS = {
+    "PERSON": ("person", "people"),
+    "CAR": ("car", "cars"),
+    "ANIMAL": ("animal", "animals"),
+    "AUDIO": ("sound", "sounds"),
+    "PARCEL": ("parcel", "parcels"),
+}
+
+
+def normalize(text):
+    """Lower case, no punctuation, single spaces, without a leading wake phrase."""
+    text = re.sub(r"[^\w\s']", " ", text.lower())
+    text = " ".join(text.split())
+    return _WAKE_PREFIX.sub("", text).strip()
+
+
+def _ordinal(n):
+    suffix = "th" if 10 <= n % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th")
+    return f"{n}{suffix}"
+
+
+def speak_time(moment):
+    """Say a timestamp in words, e.g. "today at 2:30 PM" or "on April 21st at 9 AM"."""
+    clock = moment.strftime("%I:%M %p").lstrip("0").replace(":00", "")
+    day = moment.date()
+    if day == date.today():
+        return f"today at {clock}"
+    if day == date.today() - timedelta(days=1):
+        return f"yesterday at {clock}"
+    return f"on {moment.strftime('%B')} {_ordinal(moment.day)} at {clock}"
+
+
+def _camera(row):
+    return (row.get("camera_name") or "camera").replace("_", " ")
+
+
+def _label_words(label):
+    """(singular, plural) for an event label; events without one are "events"."""
+    if not label:
+        return "event", "events"
+    return _LABELS.get(label, (label.lower(), label.lower() + "s"))
+
+
+def _count_phrase(label, count):
+    singular, plural = _label_words(label)
+    return f"{count} {singular if count == 1 else plural}"
+
+
+def _join(parts):
+    return parts[0] if len(parts) == 1 else ", ".join(parts[:-1]) + " and " + parts[-1]
+
+
+def _where(match):
+    camera = match.groupdict().get("camera")
+    return f" at the {camera}" if camera else ""
+
+
+def _camera_params(match):
+    camera = match.groupdict().get("camera")
+    # "front door" matches "Front Door", "front_door" and "frontdoor_cam"
+    return [f"%{'%'.join(camera.split())}%" if camera else "%"]
+
+
+def _render_today_summary(rows, match):
+    templates = intent_templates["today_summary"]
+    if not rows:
+        return templates["none"]
+    latest = max(rows, key=lambda row: row["last_seen"])
+    singular, _ = _label_words(latest["label"])
+    return templates["some"].format(
+        counts=_join([_count_phrase(row["label"], row["count"]) for row in rows]),
+        latest=f"{'an' if singular[0] in 'aeiou' else 'a'} {singular}",
+        when=speak_time(latest["last_seen"]),
+    )
+
+
+def _render_parcels_today(rows, match):
+    templates = intent_templates["parcels_today"]
+    if not rows:
+        return templates["none"]
+    latest = rows[0]
+    key = "one" if latest["count"] == 1 else "many"
+    return templates[key].format(count=latest["count"], when=speak_time(latest["start_time"]), camera=_camera(latest))
+
+
+def _render_last(name, unknown):
+    def render(rows, match):
+        templates = intent_templates[name]
+        if not rows:
+            return templates["none"].format(where=_where(match))
+        row = rows[0]
+        sub_label = row.get("sub_label")
+        if not sub_label or sub_label.lower() == "unknown":
+            who = unknown
+        else:
+            who = sub_label if name == "last_person" else f"{sub_label}'s car"
+        return templates["some"].format(
+            where=_where(match), who=who, when=speak_time(row["start_time"]), camera=_camera(row)
+        )
+    return render
+
+
+_AT_CAMERA = r"(?: (?:at|by|near|on) (?:the |my )?(?P<camera>[a-z ]+?))?(?: camera)?(?: today)?$"
+
+# (name, patterns, query, params(match), render(rows, match))
+INTENTS = [
+    (
+        "today_summary",
+        [
+            re.compile(r"^what('s| has)? (happened|been happening|went on)( at home| around the house)? today$"),
+            re.compile(r"^(give me |can you give me )?(a |the )?(summary|recap)( of)?( today| today's events)$"),
+        ],
+        f"""
+        SELECT label, count(*) AS count, max(start_time) AS last_seen
+        FROM {DB_TABLE_NAME}
+        WHERE start_time >= CURRENT_DATE
+        GROUP BY label
+        ORDER BY count DESC
+        LIMIT 10
+        """,
+        lambda match: None,
+        _render_today_summary,
+    ),
+    (
+        "parcels_today",
+        [
+            re.compile(r"^(was|were|is|are|has|have) there (a |an |any )?(parcels?|packages?|deliver(y|ies))( today| delivered today| been delivered today)?$"),
+            re.compile(r"^(any|did i get any|did i get a|did we get any|did we get a) (parcels?|packages?|deliver(y|ies))( today)?$"),
+        ],
+        f"""
+        SELECT start_time, camera_name, count(*) OVER () AS count
+        FROM {DB_TABLE_NAME}
+        WHERE label = 'PARCEL' AND start_time >= CURRENT_DATE
+        ORDER BY start_time DESC
+        LIMIT 1
+        """,
+        lambda match: None,
+        _render_parcels_today,
+    ),
+    (
+        "last_person",
+        [
+            re.compile(r"^(who was )?(the )?(last|latest|most recent) (person|visitor|one)( (seen|spotted))?" + _AT_CAMERA),
+            re.compile(r"^who was (the )?(last|latest) (person )?(seen )?" + _AT_CAMERA),
+        ],
+        f"""
+        SELECT sub_label, start_time, camera_name
+        FROM {DB_TABLE_NAME}
+        WHERE label = 'PERSON' AND camera_name ILIKE %s
+        ORDER BY start_time DESC
+        LIMIT 1
+        """,
+        _camera_params,
+        _render_last("last_person", "someone I didn't recognise"),
+    ),
+    (
+        "last_vehicle",
+        [
+            re.compile(r"^(what was )?(the )?(last|latest|most recent) (car|vehicle)( (seen|spotted))?" + _AT_CAMERA),
+        ],
+        f"""
+        SELECT sub_label, start_time, camera_name
+        FROM {DB_TABLE_NAME}
+        WHERE label = 'CAR' AND camera_name ILIKE %s
+        ORDER BY start_time DESC
+        LIMIT 1
+        """,
+        _camera_params,
+        _render_last("last_vehicle", "a car I didn't recognise"),
+    ),
+]
+
+# requests / hits per intent, local latency, and a running average of model
+# turns so the latency saved can be estimated.
+STATS = {
+    "requests": 0,
+    "hits": defaultdict(int),
+    "local_ms": defaultdict(float),
+    "model_turns": 0,
+    "model_ms": 0.0,
+}
+
+
+def match_intent(text):
+    """Return (name, match, query, params, render) for the first matching intent, or None."""
+    question = normalize(text)
+    if _OTHER_TIMEFRAME.search(question):
+        return None
+    for name, patterns, query, params, render in INTENTS:
+        for pattern in patterns:
+            match = pattern.search(question)
+            if match:
+                return name, match, query, params(match), render
+    return None
+
+
+def route(text):
+    """
+    Answer `text` locally if it matches a known intent. Returns the answer, or
+    None when the question should go to the model. Blocks on the database:
+    call it from a thread (asyncio.to_thread) in async code.
+    """
+    if not INTENT_ROUTER:
+        return None
+    STATS["requests"] += 1
+    started = time.perf_counter()
+    matched = match_intent(text)
+    if matched is None:
+        return None
+
+    name, match, query, params, render = matched
+    rows = query_database(query, params)
+    if isinstance(rows, dict):
+        print(f"Intent {name} query failed, falling back to the model: {rows.get('error')}")
+        return None
+    answer = render(rows, match)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    STATS["hits"][name] += 1
+    STATS["local_ms"][name] += elapsed_ms
+    print(f"Intent {name} answered locally in {elapsed_ms:.0f} ms")
+    return answer
+
+
+def record_model_turn(elapsed_ms):
+    """Record how long a question took through the model, for the latency-saved estimate."""
+    STATS["model_turns"] += 1
+    STATS["model_ms"] += elapsed_ms
+
+
+def stats():
+    """Hit rate and estimated latency saved per intent, for the /stats endpoint."""
+    hits = sum(STATS["hits"].values())
+    model_avg_ms = STATS["model_ms"] / STATS["model_turns"] if STATS["model_turns"] else None
+    intents = {}
+    for name, *_ in INTENTS:
+        count = STATS["hits"][name]
+        avg_ms = STATS["local_ms"][name] / count if count else None
+        intents[name] = {
+            "hits": count,
+            "avg_ms": avg_ms,
+            "saved_ms": (model_avg_ms - avg_ms) * count if count and model_avg_ms is not None else None,
+        }
+    return {
+        "requests": STATS["requests"],
+        "hits": hits,
+        "hit_rate": hits / STATS["requests"] if STATS["requests"] else None,
+        "model_avg_ms": model_avg_ms,
+        "intents": intents,
+    }
@@ -1,5 +1,7 @@
 from asyncio import Queue
 import asyncio
+import time
+from collections import Counter
 import websockets
 import json
 import os
@@ -8,12 +10,16 @@ from state import State
 from recording import record_voice_input
 import base64
 from database import query_database, DB_TABLE_NAME
-from audio_manager import AudioManager
-
-audio = AudioManager()
+from result_encoder import encode_rows
+from conversation_context import CONTEXT_COMPACTION, context, function_output_item, user_message_item
+from audio_manager import HEADLESS, RATE as PLAYBACK_RATE, get_audio_manager
 
 recv_lock = asyncio.Lock()
 
+# batches / calls / parallel_batches, and fanout_ms (wall time of each batch)
+# against serial_ms (sum of its calls' durations)
+TOOL_STATS = Counter()
+
 
 load_dotenv()
 
@@ -25,6 +31,10 @@ with open("prompt.txt", "r") as f:
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 model=os.getenv('MODEL')
 OPENAI_REALTIME_ENDPOINT = 'wss://api.openai.com/v1/realtime?model=gpt-4o-realtime-preview-2024-10-01'
+# Raw PCM per input_audio_buffer.append event, well below the 15 MB event limit.
+AUDIO_APPEND_CHUNK_BYTES = 256 * 1024
+# Without a speaker there is no point in having the model synthesize audio.
+MODALITIES = ["text"] if HEADLESS else ["audio", "text"]
 
 tool_specification = [
     {
@@ -67,28 +77,44 @@ async def connect_to_openai():
     }
 
     websocket = await websockets.connect(OPENAI_REALTIME_ENDPOINT, additional_headers=headers, ping_interval=10, ping_timeout=30)
+    # A new session starts with an empty conversation and no responses in flight.
+    context.reset()
+    state = State()
+    state.response_active = state.response_requested = state.cancel_next_response = False
 
     # Configure the session with the tool
     await websocket.send(json.dumps({
         'type': 'session.update',
          "session": {
-             "modalities": ["audio", "text"],
+             "modalities": MODALITIES,
              "instructions": SYSTEM_PROMPT,
              "voice": os.getenv('VOICE', 'ash'),
              "input_audio_format": "pcm16",
              "output_audio_format": "pcm16",
              "tools": tool_specification,
              "turn_detection": None,
+             # Transcripts let old audio items be compacted to text.
+             "input_audio_transcription": {"model": "whisper-1"} if CONTEXT_COMPACTION else None,
         }
     }))
     return websocket
 
 async def request_response(websocket, additional_msg=""):
     msg = SYSTEM_PROMPT + "\n\n" + additional_msg
+    state = State()
+    state.response_requested = True
+    await context.compact(websocket)
+    if not state.response_requested:
+        # Cancelled while compacting: nothing was created, so nothing to drop.
+        state.cancel_next_response = False
+        return
+    # Until response.created arrives, late events of an older response must not
+    # be mistaken for this one.
+    state.response_id = None
     await websocket.send(json.dumps({
         'type': 'response.create',
         "response": {
-            "modalities": ["audio", "text"],
+            "modalities": MODALITIES,
             "instructions": msg,
             "voice": os.getenv('VOICE', 'ash'),
             "tools": tool_specification,
@@ -96,23 +122,110 @@ async def request_response(websocket, additional_msg=""):
         },
     }))
 
-async def record_and_send(websocket):
-    audio_data = await record_voice_input()
-    encoded_audio = base64.b64encode(audio_data).decode('utf-8')
+async def send_user_message(websocket, content):
+    """
+    Append a user message (list of input_text / input_audio parts) to the
+    conversation. Every user message starts a new turn in the tracked context.
+    """
     await websocket.send(json.dumps({
         'type': 'conversation.item.create',
-        'item': {
-            'type': 'message',
-            'role': 'user',
-            'content': [
-                {
-                    'type': 'input_audio',
-                    'audio': encoded_audio
-                }
-            ]
-        }
+        'item': user_message_item(content),
     }))
-    await request_response(websocket)
+
+async def send_user_audio(websocket, audio_data):
+    """
+    Send a recording as the user's turn through the input audio buffer
+    (append + commit) rather than as an input_audio item: only committed
+    buffer audio is transcribed, and the transcript is what lets the item be
+    compacted to text later.
+    """
+    for start in range(0, len(audio_data), AUDIO_APPEND_CHUNK_BYTES):
+        encoded_audio = base64.b64encode(audio_data[start:start + AUDIO_APPEND_CHUNK_BYTES]).decode('utf-8')
+        await websocket.send(json.dumps({'type': 'input_audio_buffer.append', 'audio': encoded_audio}))
+        context.audio_appended(encoded_audio)
+    await websocket.send(json.dumps({'type': 'input_audio_buffer.commit'}))
+    context.audio_committed()
+
+async def drain_socket(websocket, timeout=0.1):
+    """Discard whatever is still queued on the socket until it goes quiet."""
+    while True:
+        try:
+            message = await asyncio.wait_for(websocket.recv(), timeout=timeout)
+        except asyncio.TimeoutError:
+            break
+        # Still tracked: response.done (usage) and item events often arrive here.
+        context.observe(json.loads(message))
+
+async def interrupt_response(websocket, played_samples=None):
+    """
+    Barge-in: cancel the response the server is still generating and truncate
+    the assistant's audio item to what was actually played, so the conversation
+    context matches what the user heard. Deltas of the cancelled response that
+    are still in flight are dropped by process_message.
+
+    A response that was requested but whose response.created has not arrived
+    yet (including the follow-up owed after tool calls) is cancelled too:
+    process_message drops it when it is created.
+    """
+    state = State()
+    cancelled_active = bool(state.response_active and state.response_id)
+    cancelled_request = not cancelled_active and state.response_requested
+    if cancelled_active:
+        state.cancelled_response_id = state.response_id
+        state.response_active = False
+    elif cancelled_request:
+        state.response_requested = False
+        state.cancel_next_response = True
+    if cancelled_active or cancelled_request:
+        state.turn_cancelled = True
+        await websocket.send(json.dumps({'type': 'response.cancel'}))
+    if state.audio_item_id and (played_samples is not None or cancelled_active):
+        await websocket.send(json.dumps({
+            'type': 'conversation.item.truncate',
+            'item_id': state.audio_item_id,
+            'content_index': 0,
+            'audio_end_ms': (played_samples or 0) * 1000 // PLAYBACK_RATE,
+        }))
+        print(f"Truncated {state.audio_item_id} at {(played_samples or 0) * 1000 // PLAYBACK_RATE} ms")
+        state.audio_item_id = None
+    state.pcm_data = b""
+
+async def cancel_response(websocket):
+    """
+    Stop the in-flight response on request (UI cancel): silence local playback,
+    then cancel and truncate as for a wake-word barge-in.
+    """
+    played_samples = None
+    audio = get_audio_manager(create=False)
+    if audio is not None:
+        played_samples = await audio.interrupt_playback()
+    await interrupt_response(websocket, played_samples)
+
+async def watch_barge_in(get_websocket, poll_interval=0.05):
+    """
+    Background task: when the wakeword fires while a response is being
+    generated or played, cancel and truncate it on the server.
+    """
+    while True:
+        await asyncio.sleep(poll_interval)
+        audio = get_audio_manager(create=False)
+        if audio is None:
+            continue
+        interrupted, played_samples = audio.take_barge_in()
+        if not interrupted:
+            continue
+        websocket = get_websocket()
+        state = State()
+        if websocket is None or not (state.response_active or state.response_requested or played_samples is not None):
+            continue
+        try:
+            await interrupt_response(websocket, played_samples)
+        except Exception as e:
+            print(f"Failed to interrupt response: {e}")
+
+async def record_and_send(websocket):
+    audio_data = await record_voice_input()
+    await send_user_audio(websocket, audio_data)
 
 
 def play_audio_response():
@@ -121,12 +234,20 @@ def play_audio_response():
     allowing interruption on hotword detection.
     """
     state = State()
+    audio = get_audio_manager()
+    if audio is None:
+        state.pcm_data = b""
+        return
     if state.pcm_data:
-        audio.stop_playback_event.clear()
         audio.play(state.pcm_data)
+        state.last_pcm_data = state.pcm_data
         state.pcm_data = b""
 
-async def process_function_call(response, websocket):
+async def process_function_call(response, websocket, on_event=None):
+    """
+    Run one tool call and return its output ('' when nothing goes back to the
+    model). Database work runs in a thread so calls of one response overlap.
+    """
     state = State()
     tool_name = response.get('name')
     tool_arguments = json.loads(response.get('arguments', '{}'))
@@ -140,72 +261,162 @@ async def process_function_call(response, websocket):
         tool_output = ''
     elif tool_name == 'query_database':
         query = tool_arguments.get('query')
-        result = query_database(query)
+        result = await asyncio.to_thread(query_database, query)
+        if isinstance(result, dict) and result.get('rejected'):
+            # Structured guard feedback goes back to the model so it retries with a cheaper query
+            state.turn_tool_failed = True
+            tool_output = json.dumps(result)
         # Filter out raw SQL and error details from user-facing responses
-        if isinstance(result, dict) and 'error' in result:
+        elif isinstance(result, dict) and 'error' in result:
+            state.turn_tool_failed = True
             tool_output = "I can't access the database right now. But I'll keep trying."
         else:
-            # Return structured data instead of raw query results
-            tool_output = json.dumps(result, default=str)
+            # Columnar, size-bounded encoding instead of one dict per row
+            tool_output = encode_rows(result)
     elif tool_name == 'retrieve_media_paths':
         event_id = tool_arguments.get('event_id')
         if not event_id:
             # Return an error if no event_id provided
+            state.turn_tool_failed = True
             tool_output = json.dumps({"error": "Missing event_id"})
         else:
             query = f"SELECT snapshot_path, video_path FROM {DB_TABLE_NAME} WHERE event_id = '{event_id}';"
-            result = query_database(query)
+            result = await asyncio.to_thread(query_database, query)
+            if isinstance(result, dict) and ('error' in result or result.get('rejected')):
+                state.turn_tool_failed = True
             state.last_media_paths.append(result)
+            if on_event:
+                await on_event({"type": "media", "media_paths": state.last_media_paths})
             tool_output = "Media retrieved successfully."
     else:
         raise ValueError(f"Unknown tool: {tool_name}")
 
     print(f"Tool output: {tool_output}")
+    return tool_output
 
-    # Send the tool output back to the conversation.
+async def process_function_calls(calls, websocket, on_event=None):
+    """
+    Run all tool calls of a finished response concurrently, submit their
+    outputs together (in call order) and request exactly one new response.
+    """
+    async def timed(call):
+        started = time.perf_counter()
+        try:
+            output = await process_function_call(call, websocket, on_event)
+        except Exception as e:
+            print(f"Tool {call.get('name')} failed: {e}")
+            State().turn_tool_failed = True
+            output = json.dumps({"error": f"Tool {call.get('name')} failed"})
+        return output, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(timed(call) for call in calls))
+    fanout_ms = (time.perf_counter() - started) * 1000
+    serial_ms = sum(duration for _, duration in results)
+    TOOL_STATS["batches"] += 1
+    TOOL_STATS["calls"] += len(calls)
+    TOOL_STATS["parallel_batches"] += len(calls) > 1
+    TOOL_STATS["fanout_ms"] += fanout_ms
+    TOOL_STATS["serial_ms"] += serial_ms
+    print(f"Ran {len(calls)} tool call(s) in {fanout_ms:.0f} ms ({serial_ms:.0f} ms one after another)")
+
+    # Send the tool outputs back to the conversation.
     # (For retrieve_media_paths, this will be the dummy message)
-    if tool_output:
+    outputs = [(call, output) for call, (output, _) in zip(calls, results) if output]
+    for call, output in outputs:
         await websocket.send(json.dumps({
             'type': 'conversation.item.create',
-            'item': {
-                'type': 'function_call_output',
-                'call_id': response['call_id'],
-                'output': tool_output
-            }
+            'item': function_output_item(call['call_id'], output),
         }))
+    state = State()
+    if not state.response_requested:
+        # Cancelled during the fan-out: keep the outputs, skip the follow-up.
+        state.cancel_next_response = False
+    # request_user_response added a user message instead of an output
+    elif outputs or any(call.get('name') == 'request_user_response' for call in calls):
         # Request a new response from the LLM.
         await request_response(websocket)
+    else:
+        state.response_requested = False
 
-async def process_message(message, websocket, text_only=False):
+def tool_stats():
+    """Tool call fan-out counters, for the /stats endpoint."""
+    batches = TOOL_STATS["batches"]
+    return {
+        **TOOL_STATS,
+        "avg_fanout_ms": TOOL_STATS["fanout_ms"] / batches if batches else None,
+        "saved_ms": TOOL_STATS["serial_ms"] - TOOL_STATS["fanout_ms"],
+    }
+
+async def process_message(message, websocket, text_only=False, on_event=None):
+    """
+    Handle one server event. `on_event`, when given, is an async callable that
+    receives transcript deltas and media paths as they arrive.
+    """
     state = State()
     response = json.loads(message)
     response_type = response.get('type')
+    context.observe(response)
     # print(response_type)
 
-    # if response_type == 'response.done':
-    #     return True
-    if response_type == "response.audio_transcript.delta":
+    # Late events of a response cancelled by barge-in: drop them undecoded.
+    if state.cancelled_response_id and response.get('response_id') == state.cancelled_response_id:
+        return False
+
+    if response_type == 'response.created':
+        if state.cancel_next_response:
+            # Cancelled before it was created: drop its events like a barge-in's.
+            state.cancel_next_response = False
+            state.cancelled_response_id = response['response']['id']
+            return False
+        state.response_id = response['response']['id']
+        state.response_active = True
+        state.response_requested = False
+        state.pending_tool_calls = []
+    elif response_type == 'response.output_item.added':
+        if response['item'].get('type') == 'message':
+            state.audio_item_id = response['item']['id']
+    elif response_type == 'response.done':
+        done = response['response']
+        if done['id'] == state.response_id:
+            state.response_active = False
+            calls, state.pending_tool_calls = state.pending_tool_calls, []
+            if done.get('status') == 'cancelled':
+                state.turn_cancelled = True
+                return True
+            if calls:
+                # The follow-up response is owed from here on, so a cancel
+                # during the fan-out withdraws it.
+                state.response_requested = True
+                await process_function_calls(calls, websocket, on_event)
+                if state.turn_cancelled and not state.response_requested:
+                    return True
+        elif done['id'] == state.cancelled_response_id and not (state.response_requested or state.response_active):
+            # A response cancelled before it was created: the turn waiting on it ends.
+            return True
+    elif response_type == "response.audio_transcript.delta":
         state.text += response['delta']
+        if on_event:
+            await on_event({"type": "transcript", "delta": response['delta']})
     elif response_type == 'response.audio.delta':
         delta = response['delta']
         state.pcm_data += base64.b64decode(delta)
     elif response_type == 'response.text.delta':
         state.text += response['delta']
-    elif response_type in ('response.audio.done', 'response.audio_transcript.done'):
+        if on_event:
+            await on_event({"type": "transcript", "delta": response['delta']})
+    elif response_type in ('response.audio.done', 'response.audio_transcript.done', 'response.text.done'):
         print(state.text)
         # Drain the websocket
-        while True:
-            try:
-                drained = await asyncio.wait_for(websocket.recv(), timeout=0.1)
-                # print(drained)
-            except asyncio.TimeoutError:
-                break
+        await drain_socket(websocket)
+        state.response_active = False
         if not text_only:
             play_audio_response()
         return True
         # state.text = ""
     elif response_type == 'response.function_call_arguments.done':
-        await process_function_call(response, websocket)
+        # Run after response.done, together with the response's other calls.
+        state.pending_tool_calls.append(response)
 
     return False
 
@@ -220,29 +431,22 @@ async def message_listener(websocket, queue):
         return
 
 async def clarify(websocket):
-    await websocket.send(json.dumps({
-        'type': 'conversation.item.create',
-        'item': {
-            'type': 'message',
-            'role': 'user',
-            'content': [
-                {
-                    'type': 'input_text',
-                    'text': "It seems the conversation has halted. Perhaps you forgot to call the 'request_user_response' tool or the 'end_conversation' tool. Do not reply to this message, simply call the tool."
-                }
-            ]
+    await send_user_message(websocket, [
+        {
+            'type': 'input_text',
+            'text': "It seems the conversation has halted. Perhaps you forgot to call the 'request_user_response' tool or the 'end_conversation' tool. Do not reply to this message, simply call the tool."
         }
-    }))
+    ])
     await request_response(websocket)
 
 
 
-async def single_interaction(websocket, text_only=False, timeout=30):
+async def single_interaction(websocket, text_only=False, timeout=30, on_event=None):
     async with recv_lock:
         try:
             async with asyncio.timeout(timeout): 
                 async for message in websocket:
-                    status = await process_message(message, websocket, text_only)
+                    status = await process_message(message, websocket, text_only, on_event)
                     if status:
                         break
         except asyncio.TimeoutError as e:
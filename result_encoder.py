@@ -0,0 +1,108 @@
+import json
+import os
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Budget for one encoded tool output, in model tokens (estimated at ~4 bytes per token).
+TOOL_OUTPUT_MAX_TOKENS = int(os.getenv("TOOL_OUTPUT_MAX_TOKENS", "800"))
+BYTES_PER_TOKEN = 4
+
+# results / truncated / rows_in / rows_out / bytes_before / bytes_after
+STATS = Counter()
+
+
+def _compact(value):
+    """Shorten values that json.dumps(default=str) would spell out at length."""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S%z")
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return int(value.total_seconds())
+    if isinstance(value, (float, Decimal)):
+        return round(float(value), 3)
+    return value
+
+
+def _dumps(value):
+    return json.dumps(value, default=str, separators=(",", ":"), ensure_ascii=False)
+
+
+def _shorten(values, max_bytes):
+    """
+    Cut the longest string cells of a row (ending them with "...") until its
+    encoding fits in `max_bytes`. Returns None if it cannot fit.
+    """
+    values = list(values)
+    while len(_dumps(values).encode()) + 1 > max_bytes:
+        longest = max(
+            (i for i, value in enumerate(values) if isinstance(value, str) and len(value) > 3),
+            key=lambda i: len(values[i]),
+            default=None,
+        )
+        if longest is None:
+            return None
+        value = values[longest]
+        values[longest] = value[:max((len(value) - 3) // 2, 0)] + "..."
+    return values
+
+
+def encode_rows(rows, max_tokens=None):
+    """
+    Encode query rows (RealDictCursor dicts) in columnar form:
+
+        {"columns": ["label", "start_time"], "rows": [["PARCEL", "2025-04-21 05:50:07"], ...]}
+
+    Column names appear once, timestamps lose microseconds, and rows are added
+    only while the output fits in `max_tokens` (default TOOL_OUTPUT_MAX_TOKENS).
+    When rows are dropped the output ends with "truncated": "N more rows". A
+    first row that is too large on its own has its long text cells cut short,
+    or is dropped if that is not enough.
+    Returns the encoded string.
+    """
+    max_bytes = (max_tokens or TOOL_OUTPUT_MAX_TOKENS) * BYTES_PER_TOKEN
+    before = len(_dumps(rows).encode())
+
+    columns = list(rows[0].keys()) if rows else []
+    encoded_rows = []
+    # {"columns":[...],"rows":[ ... ]} plus room for the truncation marker
+    size = len(_dumps({"columns": columns, "rows": []}).encode()) + len(',"truncated":"000000 more rows"')
+    for row in rows:
+        values = [_compact(row.get(column)) for column in columns]
+        row_size = len(_dumps(values).encode()) + 1
+        if size + row_size > max_bytes:
+            if encoded_rows:
+                break
+            values = _shorten(values, max_bytes - size)
+            if values is None:
+                break
+            row_size = len(_dumps(values).encode()) + 1
+        encoded_rows.append(values)
+        size += row_size
+
+    output = {"columns": columns, "rows": encoded_rows}
+    remaining = len(rows) - len(encoded_rows)
+    if remaining:
+        output["truncated"] = f"{remaining} more rows"
+    encoded = _dumps(output)
+
+    after = len(encoded.encode())
+    STATS["results"] += 1
+    STATS["truncated"] += bool(remaining)
+    STATS["rows_in"] += len(rows)
+    STATS["rows_out"] += len(encoded_rows)
+    STATS["bytes_before"] += before
+    STATS["bytes_after"] += after
+    print(f"Tool output: {len(rows)} rows, {before} -> {after} bytes (~{after // BYTES_PER_TOKEN} tokens)"
+          + (f", {remaining} rows truncated" if remaining else ""))
+    return encoded
+
+
+def stats():
+    """Encoder counters, for the /stats endpoint."""
+    return dict(STATS)
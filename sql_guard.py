@@ -0,0 +1,176 @@
+import os
+import re
+from collections import Counter
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Plans whose estimated total cost (EXPLAIN units) exceeds this are not run.
+SQL_MAX_COST = float(os.getenv("SQL_MAX_COST", "10000"))
+# LIMIT injected when the outer query has none, and the ceiling for explicit LIMITs.
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "50"))
+# Server-side safety net for anything the estimate gets wrong.
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "5000"))
+
+# checked / rewritten / rejected, plus rejected_<reason> per rejection reason.
+STATS = Counter()
+
+# String literals, quoted identifiers and comments
+_TOKENS = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", re.S)
+_FORBIDDEN = re.compile(
+    r"\b(insert|update|delete|merge|drop|alter|create|truncate|grant|revoke|copy|"
+    r"vacuum|analyze|call|do|lock|listen|notify|prepare|execute|refresh|reindex|cluster|into)\b",
+    re.I,
+)
+_ALIAS_OR_QUALIFIED = re.compile(r"(?:\bas\s+|\.\s*)$", re.I)
+_FORBIDDEN_FUNCTIONS = re.compile(r"\b(pg_\w+|dblink\w*|lo_\w+|set_config)\s*\(", re.I)
+_SELECT_STAR = re.compile(r"(?:\bselect|,)\s*(?:distinct\s+)?(?:\w+\.)?\*", re.I)
+_CROSS_JOIN = re.compile(r"\bcross\s+join\b|\bfrom\s+[\w.\"]+(?:\s+(?:as\s+)?\w+)?\s*,", re.I)
+# The row-limiting clause at the end of the outer query, in any order PostgreSQL
+# accepts: LIMIT n|ALL, FETCH FIRST|NEXT [n] ROW[S] ONLY|WITH TIES, either one
+# optionally preceded or followed by OFFSET m [ROW[S]].
+_OFFSET = r"offset\s+\d+(?:\s+rows?)?"
+_TRAILING_LIMIT = re.compile(
+    rf"(?:\b{_OFFSET}\s+)?"
+    r"(?:\b(?P<kind>limit)\s+(?P<limit>\d+|all)\b"
+    r"|\b(?P<fetch>fetch\s+(?:first|next))(?:\s+(?P<rows>\d+))?\s+rows?\s+(?:only|with\s+ties))"
+    rf"(?:\s+{_OFFSET})?\s*$",
+    re.I,
+)
+
+
+class QueryRejected(Exception):
+    """
+    Raised when a query is not allowed to run. `feedback()` is sent back to the
+    model as the tool output so it can retry with a cheaper query.
+    """
+    def __init__(self, reason, message, hint, **details):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.hint = hint
+        self.details = details
+
+    def feedback(self):
+        return {
+            "error": "query_rejected",
+            "rejected": True,
+            "reason": self.reason,
+            "message": self.message,
+            "hint": self.hint,
+            **self.details,
+        }
+
+
+def _reject(reason, message, hint, **details):
+    STATS["rejected"] += 1
+    STATS[f"rejected_{reason}"] += 1
+    raise QueryRejected(reason, message, hint, **details)
+
+
+def _forbidden_keyword(scan):
+    """First write/DDL keyword in `scan` that is not a column alias (AS do) or a qualified name (t.lock)."""
+    for match in _FORBIDDEN.finditer(scan):
+        if not _ALIAS_OR_QUALIFIED.search(scan, 0, match.start()):
+            return match
+    return None
+
+
+def check_query(query):
+    """
+    Static checks on an LLM-generated query, before it reaches the database.
+
+    Returns (query, rewrites): the query to execute (comments stripped, LIMIT
+    injected or clamped) and a list of the rewrites applied. Raises
+    QueryRejected for anything that is not a single read-only SELECT or that
+    uses SELECT * / cross joins.
+    """
+    STATS["checked"] += 1
+    # Drop comments but keep string literals and quoted identifiers. The copy
+    # used for scanning has both blanked, so `"update"` or a literal 'drop' is
+    # not mistaken for a keyword.
+    cleaned = _TOKENS.sub(lambda m: m.group(0) if m.group(0)[0] in "'\"" else " ", query or "")
+    cleaned = cleaned.strip().rstrip(";").strip()
+    scan = _TOKENS.sub(lambda m: "''" if m.group(0)[0] == "'" else '"_"', cleaned)
+
+    if not cleaned:
+        _reject("empty", "The query is empty.", "Send a single SELECT statement.")
+    if ";" in scan:
+        _reject("multiple_statements", "Only one statement may be executed per call.",
+                "Send a single SELECT statement without semicolons.")
+    if not re.match(r"(select|with)\b", scan, re.I):
+        _reject("not_select", "Only SELECT queries are allowed.",
+                "Rewrite the request as a single read-only SELECT on event_event.")
+    forbidden = _forbidden_keyword(scan) or _FORBIDDEN_FUNCTIONS.search(scan)
+    if forbidden:
+        _reject("not_read_only", f"'{forbidden.group(1)}' is not allowed in a read-only query.",
+                "Only read from event_event with a plain SELECT.")
+    if _SELECT_STAR.search(scan):
+        _reject("select_star", "SELECT * is not allowed.",
+                "List only the columns you need, e.g. event_id, label, sub_label, start_time, camera_name.")
+    if _CROSS_JOIN.search(scan):
+        _reject("cross_join", "Cross joins are not allowed.",
+                "Query event_event alone, or use an explicit JOIN ... ON condition.")
+
+    rewrites = []
+    limit = _TRAILING_LIMIT.search(scan)
+    if limit is None:
+        cleaned = f"{cleaned}\nLIMIT {SQL_MAX_ROWS}"
+        rewrites.append(f"added LIMIT {SQL_MAX_ROWS}")
+    else:
+        group = "limit" if limit.group("kind") else "rows"
+        count = limit.group(group)
+        # FETCH FIRST ROW ONLY (no count) is one row: nothing to clamp.
+        if count is not None and (count.lower() == "all" or int(count) > SQL_MAX_ROWS):
+            # The clause has no literals, so its offsets from the end match in both copies.
+            start = len(cleaned) - (len(scan) - limit.start(group))
+            end = len(cleaned) - (len(scan) - limit.end(group))
+            cleaned = f"{cleaned[:start]}{SQL_MAX_ROWS}{cleaned[end:]}"
+            clause = "LIMIT" if group == "limit" else limit.group("fetch").upper()
+            rewrites.append(f"clamped {clause} {count} to {SQL_MAX_ROWS}")
+
+    if rewrites:
+        STATS["rewritten"] += 1
+    return cleaned, rewrites
+
+
+def _seq_scans(plan):
+    """Relations read with a sequential scan anywhere in the plan tree."""
+    found = set()
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name"):
+        found.add(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found |= _seq_scans(child)
+    return found
+
+
+def check_plan(cursor, query, params=None):
+    """
+    EXPLAIN the query and reject it when the planner's estimated total cost is
+    above SQL_MAX_COST. Returns a short plan summary for logging.
+    """
+    cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    row = cursor.fetchone()
+    plan = (row["QUERY PLAN"] if isinstance(row, dict) else row[0])[0]["Plan"]
+    summary = {
+        "node": plan.get("Node Type"),
+        "cost": plan.get("Total Cost"),
+        "rows": plan.get("Plan Rows"),
+        "seq_scans": sorted(_seq_scans(plan)),
+    }
+    if summary["cost"] is not None and summary["cost"] > SQL_MAX_COST:
+        _reject(
+            "too_expensive",
+            f"The query is too expensive to run (estimated cost {summary['cost']:.0f}, limit {SQL_MAX_COST:.0f}).",
+            "Narrow the start_time range, filter on label or camera_name, "
+            "aggregate with COUNT instead of listing rows, or select fewer columns.",
+            estimated_cost=summary["cost"],
+            estimated_rows=summary["rows"],
+        )
+    return summary
+
+
+def stats():
+    """Guard counters, for the /stats endpoint."""
+    return dict(STATS)
@@ -1,3 +1,12 @@
+import os
+import time
+from collections import deque
+
+# Conversation history retention: at most this many turns, none older than this.
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "50"))
+HISTORY_MAX_AGE = float(os.getenv("HISTORY_MAX_AGE", str(24 * 60 * 60)))
+
+
 class Singleton(type):
     _instances = {}
     def __call__(cls, *args, **kwargs):
@@ -5,16 +14,121 @@ class Singleton(type):
             cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
+class TurnRecord:
+    """One question/answer exchange."""
+    __slots__ = ("started_at", "kind", "question", "answer", "media_paths")
+
+    def __init__(self, kind, question=""):
+        self.started_at = time.time()
+        self.kind = kind
+        self.question = question
+        self.answer = ""
+        self.media_paths = []
+
+
+class ConversationHistory:
+    """Ring buffer of TurnRecords, bounded by count and by age."""
+
+    def __init__(self, max_turns=HISTORY_MAX_TURNS, max_age=HISTORY_MAX_AGE):
+        self.max_age = max_age
+        self._turns = deque(maxlen=max_turns)
+
+    def append(self, record):
+        self.prune()
+        self._turns.append(record)
+
+    def prune(self):
+        cutoff = time.time() - self.max_age
+        while self._turns and self._turns[0].started_at < cutoff:
+            self._turns.popleft()
+
+    def __iter__(self):
+        return iter(self._turns)
+
+    def __len__(self):
+        return len(self._turns)
+
+    def text_bytes(self):
+        return sum(len(turn.question) + len(turn.answer) for turn in self._turns)
+
+
 class State(metaclass=Singleton):
 
     def __init__(self):
         self.end_conversation = False
         self.pcm_data = b""
+        self.last_pcm_data = b""
         self.text = ""
         self.last_media_paths = []
+        # Realtime response tracking for barge-in. Not cleared by reset(): a
+        # cancelled response's late deltas can arrive during the next turn.
+        self.response_id = None
+        self.response_active = False
+        # response.create sent (or owed after a response's tool calls) but
+        # response.created not seen yet
+        self.response_requested = False
+        # a cancel landed while response_requested: the next response.created
+        # is the cancelled response
+        self.cancel_next_response = False
+        self.audio_item_id = None
+        self.cancelled_response_id = None
+        # the current turn's response was cancelled (barge-in or UI cancel), so
+        # its text is partial
+        self.turn_cancelled = False
+        # a tool call of the current turn failed or its query was rejected, so
+        # the answer may be an apology or a guess
+        self.turn_tool_failed = False
+        # function_call_arguments.done events of the current response, run
+        # together once it is done
+        self.pending_tool_calls = []
+
+        self.history = ConversationHistory()
+        self.current_turn = None
 
     def reset(self):
         self.end_conversation = False
         self.pcm_data = b""
+        self.last_pcm_data = b""
         self.text = ""
         self.last_media_paths = []
+
+    def begin_turn(self, kind, question=""):
+        """
+        Start a new exchange: clear the per-turn text, audio and media paths
+        and open a history record for it.
+        """
+        self.reset()
+        self.turn_cancelled = False
+        self.turn_tool_failed = False
+        self.current_turn = TurnRecord(kind, question)
+        self.history.append(self.current_turn)
+
+    def end_turn(self):
+        """Close the current exchange and return its answer text."""
+        answer = self.text.strip()
+        if self.current_turn is not None:
+            self.current_turn.answer = answer
+            self.current_turn.media_paths = list(self.last_media_paths)
+        return answer
+
+    def memory_stats(self):
+        """Memory gauges for the /stats endpoint."""
+        self.history.prune()
+        return {
+            "history_turns": len(self.history),
+            "history_text_bytes": self.history.text_bytes(),
+            "turn_text_bytes": len(self.text),
+            "turn_media_paths": len(self.last_media_paths),
+            "pcm_bytes": len(self.pcm_data),
+            "last_pcm_bytes": len(self.last_pcm_data),
+            "process_rss_bytes": _process_rss(),
+        }
+
+
+def _process_rss():
+    """Resident set size of this process, where /proc is available."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
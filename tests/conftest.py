@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The application modules live at the repository root and open their
+# templates (event_templates.yml, intent_templates.yml) relative to it.
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
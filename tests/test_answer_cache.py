@@ -0,0 +1,132 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("psycopg2")
+pytest.importorskip("websockets")
+
+import answer_cache  # noqa: E402
+from answer_cache import AnswerCache  # noqa: E402
+from state import State  # noqa: E402
+
+
+def test_hit_and_miss():
+    cache = AnswerCache(max_entries=4, ttl=60)
+    cache.put("a", "answer a")
+    assert cache.get("a").text == "answer a"
+    assert cache.get("b") is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_expired_entries_are_removed():
+    cache = AnswerCache(max_entries=4, ttl=60)
+    cache.put("a", "answer a")
+    cache._entries["a"].created_at -= 61
+    assert cache.get("a") is None
+    assert cache.stats()["expired"] == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_evicts_least_recently_used():
+    cache = AnswerCache(max_entries=2, ttl=60)
+    cache.put("a", "answer a")
+    cache.put("b", "answer b")
+    cache.get("a")
+    cache.put("c", "answer c")
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evicted"] == 1
+
+
+def test_disabled_cache():
+    cache = AnswerCache(max_entries=0, ttl=60)
+    assert not cache.enabled
+    assert cache.key("what happened today") is None
+    cache.put("a", "answer a")
+    assert cache.get("a") is None
+
+
+def test_none_key_and_empty_text_are_not_cached():
+    cache = AnswerCache(max_entries=4, ttl=60)
+    cache.put(None, "answer")
+    cache.put("a", "")
+    assert cache.stats()["entries"] == 0
+
+
+def test_audio_budget_drops_least_recently_used_audio():
+    cache = AnswerCache(max_entries=4, ttl=60, max_audio_bytes=10)
+    cache.put("a", "answer a", b"x" * 6)
+    cache.put("b", "answer b", b"y" * 6)
+    assert cache.get("a").pcm_data == b""
+    assert cache.get("a").text == "answer a"
+    assert cache.get("b").pcm_data == b"y" * 6
+    assert cache.stats()["audio_bytes"] == 6
+    assert cache.stats()["audio_dropped"] == 1
+
+
+def test_oversized_audio_is_not_kept():
+    cache = AnswerCache(max_entries=4, ttl=60, max_audio_bytes=10)
+    cache.put("a", "answer a", b"x" * 11)
+    assert cache.get("a").pcm_data == b""
+    assert cache.stats()["audio_bytes"] == 0
+
+
+def test_replacing_and_evicting_release_audio_bytes():
+    cache = AnswerCache(max_entries=1, ttl=60, max_audio_bytes=100)
+    cache.put("a", "answer a", b"x" * 6)
+    cache.put("a", "answer a", b"x" * 4)
+    assert cache.stats()["audio_bytes"] == 4
+    cache.put("b", "answer b", b"y" * 3)
+    assert cache.stats()["audio_bytes"] == 3
+
+
+@pytest.fixture
+def turn(monkeypatch):
+    monkeypatch.setattr(answer_cache, "cache", AnswerCache(max_entries=4, ttl=60))
+    state = State()
+    state.begin_turn("ask", "what happened today")
+    state.text = "Two people came by."
+    return state
+
+
+def test_store_keeps_a_finished_turn(turn):
+    answer_cache.store("key")
+    assert answer_cache.cache.get("key").text == "Two people came by."
+
+
+def test_store_skips_cancelled_turns(turn):
+    turn.turn_cancelled = True
+    answer_cache.store("key")
+    assert answer_cache.cache.get("key") is None
+
+
+def test_store_skips_turns_with_failed_tool_calls(turn):
+    turn.turn_tool_failed = True
+    turn.text = "I can't access the database right now."
+    answer_cache.store("key")
+    assert answer_cache.cache.get("key") is None
+    assert answer_cache.cache.stats()["not_stored_tool_failed"] == 1
+
+
+@pytest.mark.parametrize("result", [
+    {"error": "canceling statement due to statement timeout"},
+    {"error": "query_rejected", "rejected": True, "reason": "too_expensive"},
+])
+def test_failed_queries_mark_the_turn(turn, monkeypatch, result):
+    import openai_socket
+
+    monkeypatch.setattr(openai_socket, "query_database", lambda query: result)
+    call = {"name": "query_database", "arguments": json.dumps({"query": "SELECT label FROM event_event"})}
+    asyncio.run(openai_socket.process_function_call(call, websocket=None))
+    assert turn.turn_tool_failed
+
+
+def test_successful_query_leaves_the_turn_cacheable(turn, monkeypatch):
+    import openai_socket
+
+    monkeypatch.setattr(openai_socket, "query_database", lambda query: [{"label": "PERSON"}])
+    call = {"name": "query_database", "arguments": json.dumps({"query": "SELECT label FROM event_event"})}
+    asyncio.run(openai_socket.process_function_call(call, websocket=None))
+    assert not turn.turn_tool_failed
@@ -0,0 +1,67 @@
+import uuid
+
+import pytest
+
+from audio_ipc import PcmRing
+
+
+@pytest.fixture
+def ring():
+    ring = PcmRing(f"test_ring_{uuid.uuid4().hex[:12]}", 16, create=True)
+    yield ring
+    ring.close()
+
+
+def test_write_returns_absolute_offsets(ring):
+    assert ring.write(b"abcd") == 0
+    assert ring.write(b"efgh") == 4
+    assert ring.written == 8
+    assert ring.read(0, 4) == b"abcd"
+    assert ring.read(4, 4) == b"efgh"
+
+
+def test_wraps_around(ring):
+    ring.write(b"x" * 12)
+    offset = ring.write(b"0123456789")
+    assert offset == 12
+    assert ring.read(offset, 10) == b"0123456789"
+
+
+def test_overwritten_data_is_rejected(ring):
+    ring.write(b"a" * 10)
+    ring.write(b"b" * 10)
+    assert ring.read(0, 10) is None
+    assert ring.read(10, 10) == b"b" * 10
+
+
+def test_data_larger_than_the_ring_keeps_its_tail(ring):
+    data = bytes(range(20))
+    offset = ring.write(data)
+    assert ring.written == 16
+    assert ring.read(offset, 16) == data[-16:]
+
+
+def test_attached_ring_sees_the_writer():
+    name = f"test_ring_{uuid.uuid4().hex[:12]}"
+    writer = PcmRing(name, 16, create=True)
+    try:
+        offset = writer.write(b"hello")
+        reader = PcmRing(name)
+        assert reader.capacity == 16
+        assert reader.read(offset, 5) == b"hello"
+        reader.close()
+    finally:
+        writer.close()
+
+
+def test_create_replaces_a_stale_segment():
+    name = f"test_ring_{uuid.uuid4().hex[:12]}"
+    stale = PcmRing(name, 16, create=True)
+    stale.write(b"old")
+    ring = PcmRing(name, 32, create=True)
+    try:
+        assert ring.written == 0
+        assert ring.capacity == 32
+    finally:
+        stale.shm.close()
+        ring.close()
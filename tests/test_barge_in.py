@@ -0,0 +1,105 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("psycopg2")
+pytest.importorskip("websockets")
+
+import openai_socket  # noqa: E402
+from state import State  # noqa: E402
+
+
+class Socket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message)["type"])
+
+
+@pytest.fixture
+def state():
+    state = State()
+    state.response_id = state.cancelled_response_id = state.audio_item_id = None
+    state.response_active = state.response_requested = state.cancel_next_response = False
+    state.pending_tool_calls = []
+    state.begin_turn("ask")
+    return state
+
+
+def receive(socket, event):
+    return asyncio.run(openai_socket.process_message(json.dumps(event), socket, text_only=True))
+
+
+def test_cancel_of_an_active_response(state):
+    socket = Socket()
+    asyncio.run(openai_socket.request_response(socket))
+    receive(socket, {"type": "response.created", "response": {"id": "r1"}})
+    asyncio.run(openai_socket.interrupt_response(socket))
+    assert socket.sent == ["response.create", "response.cancel"]
+    assert receive(socket, {"type": "response.text.delta", "response_id": "r1", "delta": "late"}) is False
+    assert receive(socket, {"type": "response.done", "response": {"id": "r1", "status": "cancelled"}}) is True
+    assert state.turn_cancelled
+    assert state.text == ""
+
+
+def test_cancel_before_response_created(state):
+    socket = Socket()
+    asyncio.run(openai_socket.request_response(socket))
+    asyncio.run(openai_socket.interrupt_response(socket))
+    assert socket.sent == ["response.create", "response.cancel"]
+    assert state.turn_cancelled
+
+    assert receive(socket, {"type": "response.created", "response": {"id": "r1"}}) is False
+    assert state.response_id is None
+    assert receive(socket, {"type": "response.text.delta", "response_id": "r1", "delta": "late"}) is False
+    assert state.text == ""
+    # the turn that was waiting on it ends
+    assert receive(socket, {"type": "response.done", "response": {"id": "r1", "status": "cancelled"}}) is True
+
+
+def test_next_turn_does_not_adopt_a_cancelled_response(state):
+    socket = Socket()
+    asyncio.run(openai_socket.request_response(socket))
+    asyncio.run(openai_socket.interrupt_response(socket))
+
+    state.begin_turn("ask")
+    asyncio.run(openai_socket.request_response(socket))
+    receive(socket, {"type": "response.created", "response": {"id": "old"}})
+    assert receive(socket, {"type": "response.done", "response": {"id": "old", "status": "cancelled"}}) is False
+    receive(socket, {"type": "response.created", "response": {"id": "new"}})
+    receive(socket, {"type": "response.text.delta", "response_id": "new", "delta": "answer"})
+    assert state.response_id == "new"
+    assert state.text == "answer"
+    assert not state.turn_cancelled
+
+
+def test_cancel_during_tool_calls_skips_the_follow_up(state, monkeypatch):
+    socket = Socket()
+
+    async def slow_tool(call, websocket, on_event=None):
+        await asyncio.sleep(0.05)
+        return "rows"
+    monkeypatch.setattr(openai_socket, "process_function_call", slow_tool)
+
+    async def turn():
+        await openai_socket.request_response(socket)
+        await openai_socket.process_message(json.dumps({"type": "response.created", "response": {"id": "r1"}}), socket)
+        await openai_socket.process_message(json.dumps({
+            "type": "response.function_call_arguments.done", "response_id": "r1",
+            "name": "query_database", "arguments": "{}", "call_id": "call_1",
+        }), socket)
+        done = asyncio.create_task(openai_socket.process_message(
+            json.dumps({"type": "response.done", "response": {"id": "r1", "status": "completed"}}), socket
+        ))
+        await asyncio.sleep(0.01)
+        await openai_socket.interrupt_response(socket)
+        return await done
+
+    assert asyncio.run(turn()) is True
+    # the tool output is kept, but no follow-up response is requested
+    assert socket.sent == ["response.create", "response.cancel", "conversation.item.create"]
+    assert state.turn_cancelled
+    assert not state.cancel_next_response
@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+import pytest
+
+from conversation_context import CONTEXT_COMPACTION, ConversationContext, summarize_tool_output
+
+pytestmark = pytest.mark.skipif(not CONTEXT_COMPACTION, reason="CONTEXT_COMPACTION is off")
+
+
+class Socket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+    def types(self):
+        return [message["type"] for message in self.sent]
+
+
+def compact(context):
+    socket = Socket()
+    asyncio.run(context.compact(socket))
+    return socket
+
+
+def turn(context, transcript="what happened today", answer="Nothing much happened today."):
+    """One voice turn: user audio with its transcript, then an assistant audio answer."""
+    context.begin_turn()
+    context.add(f"user_{context.turn}", "user_audio", 100, transcript=transcript)
+    context.add(f"assistant_{context.turn}", "assistant_audio", 200, transcript=answer)
+
+
+def test_recent_turns_are_kept():
+    context = ConversationContext(keep_turns=2, max_tokens=10_000)
+    turn(context)
+    turn(context)
+    assert compact(context).sent == []
+    assert context.tokens() == 600
+
+
+def test_old_audio_is_replaced_by_its_transcript():
+    context = ConversationContext(keep_turns=1, max_tokens=10_000)
+    turn(context)
+    turn(context)
+    socket = compact(context)
+    assert socket.types() == ["conversation.item.create", "conversation.item.delete"] * 2
+
+    create_user, delete_user, create_assistant, _ = socket.sent
+    assert create_user["previous_item_id"] == "root"
+    assert create_user["item"]["content"] == [{"type": "input_text", "text": "what happened today"}]
+    assert delete_user["item_id"] == "user_1"
+    # inserted after the user item's replacement, keeping the order
+    assert create_assistant["previous_item_id"] == create_user["item"]["id"]
+    assert context.counters["audio_replaced"] == 2
+    assert context.tokens() < 600
+    # already compacted: nothing more to send
+    assert compact(context).sent == []
+
+
+def test_audio_without_transcript():
+    context = ConversationContext(keep_turns=1, max_tokens=10_000)
+    turn(context, transcript=None, answer="")
+    turn(context)
+    socket = compact(context)
+    # the user transcript may still arrive; the truncated answer can only be deleted
+    assert socket.sent == [{"type": "conversation.item.delete", "item_id": "assistant_1"}]
+    assert [item.item_id for item in context._items][0] == "user_1"
+
+
+def test_tool_output_is_summarized():
+    context = ConversationContext(keep_turns=1, max_tokens=10_000)
+    context.begin_turn()
+    output = json.dumps({"columns": ["label"], "rows": [["PERSON"]] * 40, "truncated": "10 more rows"})
+    context.add("output_1", "function_call_output", 500, call_id="call_1", transcript=output)
+    turn(context)
+    socket = compact(context)
+    create = socket.sent[0]["item"]
+    assert create["type"] == "function_call_output"
+    assert create["call_id"] == "call_1"
+    assert create["output"] == summarize_tool_output(output)
+    assert "40 rows of label (10 more rows not shown)" in create["output"]
+    assert context.counters["tool_outputs_summarized"] == 1
+
+
+def test_oldest_turns_are_dropped_over_budget():
+    context = ConversationContext(keep_turns=1, max_tokens=250)
+    for _ in range(3):
+        turn(context, transcript="x" * 400, answer="y" * 400)
+    socket = compact(context)
+    deleted = [message["item_id"] for message in socket.sent if message["type"] == "conversation.item.delete"]
+    assert deleted[:4] == ["user_1", "assistant_1", "user_2", "assistant_2"]
+    assert context.counters["turns_dropped"] == 2
+    assert {item.turn for item in context._items} == {3}
+
+
+def test_observe_tracks_server_items():
+    context = ConversationContext()
+    context.audio_appended("A" * 64_000)
+    context.audio_committed()
+    context.observe({
+        "type": "conversation.item.created",
+        "item": {"id": "item_1", "type": "message", "role": "user", "content": [{"type": "input_audio"}]},
+    })
+    context.observe({
+        "type": "conversation.item.input_audio_transcription.completed",
+        "item_id": "item_1",
+        "transcript": "hello",
+    })
+    item = context._by_id["item_1"]
+    assert (item.kind, item.turn, item.transcript) == ("user_audio", 1, "hello")
+    assert item.tokens > 0
+
+    context.observe({"type": "conversation.item.deleted", "item_id": "item_1"})
+    assert context.tokens() == 0 and not context._by_id
+
+
+def test_recorded_voice_turn_is_compacted_once_transcribed(monkeypatch):
+    """A hub recording, followed by the events the server sends for committed buffer audio."""
+    pytest.importorskip("numpy")
+    pytest.importorskip("psycopg2")
+    pytest.importorskip("websockets")
+    import openai_socket
+
+    context = ConversationContext(keep_turns=1, max_tokens=10_000)
+    monkeypatch.setattr(openai_socket, "context", context)
+    socket = Socket()
+    asyncio.run(openai_socket.send_user_audio(socket, b"\0" * 48_000 * 3))
+    assert socket.types()[-1] == "input_audio_buffer.commit"
+    assert set(socket.types()[:-1]) == {"input_audio_buffer.append"}
+
+    for event in [
+        {"type": "input_audio_buffer.committed", "previous_item_id": None, "item_id": "item_user"},
+        {"type": "conversation.item.created", "previous_item_id": None, "item": {
+            "id": "item_user", "object": "realtime.item", "type": "message", "status": "completed",
+            "role": "user", "content": [{"type": "input_audio", "transcript": None}],
+        }},
+        {"type": "conversation.item.input_audio_transcription.completed", "item_id": "item_user",
+         "content_index": 0, "transcript": "was there a parcel"},
+    ]:
+        context.observe(event)
+    item = context._by_id["item_user"]
+    assert (item.kind, item.turn, item.transcript) == ("user_audio", 1, "was there a parcel")
+    assert item.tokens >= 30
+
+    turn(context)
+    socket = compact(context)
+    assert socket.types()[:2] == ["conversation.item.create", "conversation.item.delete"]
+    assert socket.sent[0]["item"]["content"] == [{"type": "input_text", "text": "was there a parcel"}]
+    assert socket.sent[1]["item_id"] == "item_user"
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("psycopg2")
+
+from intent_router import _render_today_summary, match_intent  # noqa: E402
+
+
+def intent(text):
+    matched = match_intent(text)
+    return matched and matched[0]
+
+
+@pytest.mark.parametrize("text, name", [
+    ("Hey Jupiter, what happened today?", "today_summary"),
+    ("give me a summary of today", "today_summary"),
+    ("Was there a parcel today?", "parcels_today"),
+    ("did we get any packages", "parcels_today"),
+    ("Who was the last person at the front door?", "last_person"),
+    ("last visitor", "last_person"),
+    ("What was the last car on the driveway camera?", "last_vehicle"),
+])
+def test_matches(text, name):
+    assert intent(text) == name
+
+
+@pytest.mark.parametrize("text", [
+    "What happened yesterday?",
+    "Was there a parcel this week?",
+    "Who was the last person at the door two hours ago?",
+    "Turn on the lights",
+    "",
+])
+def test_leaves_other_questions_to_the_model(text):
+    assert match_intent(text) is None
+
+
+def test_camera_parameter():
+    name, match, query, params, render = match_intent("who was the last person at the front door")
+    assert match.group("camera") == "front door"
+    assert params == ["%front%door%"]
+    assert "%s" in query
+
+
+def test_any_camera_when_none_named():
+    _, _, _, params, _ = match_intent("last person")
+    assert params == ["%"]
+
+
+def test_today_summary_handles_events_without_label():
+    rows = [
+        {"label": "PERSON", "count": 2, "last_seen": datetime(2025, 4, 21, 9, 0)},
+        {"label": None, "count": 1, "last_seen": datetime(2025, 4, 21, 10, 0)},
+    ]
+    answer = _render_today_summary(rows, None)
+    assert "2 people and 1 event" in answer
+    assert "The latest was an event" in answer
@@ -0,0 +1,52 @@
+import json
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from result_encoder import BYTES_PER_TOKEN, encode_rows
+
+
+def test_columnar_and_compact_values():
+    rows = [
+        {"label": "PARCEL", "start_time": datetime(2025, 4, 21, 5, 50, 7, 123456), "score": Decimal("0.87654")},
+        {"label": "PERSON", "start_time": datetime(2025, 4, 21, 6, 0, 0), "score": 0.5},
+    ]
+    assert json.loads(encode_rows(rows)) == {
+        "columns": ["label", "start_time", "score"],
+        "rows": [["PARCEL", "2025-04-21 05:50:07", 0.877], ["PERSON", "2025-04-21 06:00:00", 0.5]],
+    }
+
+
+def test_timedelta_as_seconds():
+    assert json.loads(encode_rows([{"duration": timedelta(minutes=2)}]))["rows"] == [[120]]
+
+
+def test_empty_result():
+    assert json.loads(encode_rows([])) == {"columns": [], "rows": []}
+
+
+def test_truncates_to_budget():
+    rows = [{"event_id": f"event-{i:04d}", "label": "PERSON"} for i in range(500)]
+    encoded = encode_rows(rows, max_tokens=100)
+    assert len(encoded.encode()) <= 100 * BYTES_PER_TOKEN
+    output = json.loads(encoded)
+    assert 0 < len(output["rows"]) < 500
+    assert output["truncated"] == f"{500 - len(output['rows'])} more rows"
+
+
+def test_oversized_first_row_is_shortened():
+    rows = [{"label": "PERSON", "description": "x" * 5000}, {"label": "CAR", "description": "short"}]
+    encoded = encode_rows(rows, max_tokens=100)
+    assert len(encoded.encode()) <= 100 * BYTES_PER_TOKEN
+    output = json.loads(encoded)
+    label, description = output["rows"][0]
+    assert label == "PERSON"
+    assert description.endswith("...") and len(description) < 5000
+    # the shortened cell may leave room for the rows that follow
+    assert output["rows"][1:] in ([], [["CAR", "short"]])
+
+
+def test_first_row_that_cannot_fit_is_dropped():
+    rows = [{f"c{i}": i for i in range(100)}]
+    output = json.loads(encode_rows(rows, max_tokens=100))
+    assert output["rows"] == []
+    assert output["truncated"] == "1 more rows"
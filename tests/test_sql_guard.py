@@ -0,0 +1,83 @@
+import pytest
+
+from sql_guard import SQL_MAX_ROWS, QueryRejected, check_query
+
+
+def rejected(query):
+    with pytest.raises(QueryRejected) as excinfo:
+        check_query(query)
+    return excinfo.value.reason
+
+
+def test_adds_limit_when_missing():
+    query, rewrites = check_query("SELECT label FROM event_event;")
+    assert query == f"SELECT label FROM event_event\nLIMIT {SQL_MAX_ROWS}"
+    assert rewrites == [f"added LIMIT {SQL_MAX_ROWS}"]
+
+
+def test_keeps_limit_within_bounds():
+    query, rewrites = check_query("SELECT label FROM event_event LIMIT 5")
+    assert query == "SELECT label FROM event_event LIMIT 5"
+    assert rewrites == []
+
+
+@pytest.mark.parametrize("clause, expected", [
+    ("LIMIT 1000", f"LIMIT {SQL_MAX_ROWS}"),
+    ("LIMIT ALL", f"LIMIT {SQL_MAX_ROWS}"),
+    ("OFFSET 10 LIMIT 1000", f"OFFSET 10 LIMIT {SQL_MAX_ROWS}"),
+    ("LIMIT 1000 OFFSET 10", f"LIMIT {SQL_MAX_ROWS} OFFSET 10"),
+    ("FETCH FIRST 1000 ROWS ONLY", f"FETCH FIRST {SQL_MAX_ROWS} ROWS ONLY"),
+    ("OFFSET 5 ROWS FETCH NEXT 1000 ROWS ONLY", f"OFFSET 5 ROWS FETCH NEXT {SQL_MAX_ROWS} ROWS ONLY"),
+])
+def test_clamps_row_limit(clause, expected):
+    query, rewrites = check_query(f"SELECT label FROM event_event ORDER BY start_time {clause}")
+    assert query == f"SELECT label FROM event_event ORDER BY start_time {expected}"
+    assert len(rewrites) == 1 and rewrites[0].startswith("clamped")
+
+
+def test_fetch_first_row_only_is_a_limit():
+    query, rewrites = check_query("SELECT label FROM event_event FETCH FIRST ROW ONLY")
+    assert query == "SELECT label FROM event_event FETCH FIRST ROW ONLY"
+    assert rewrites == []
+
+
+def test_strips_comments_but_keeps_literals():
+    query, _ = check_query("SELECT label -- the label\nFROM event_event WHERE label = 'drop; --' LIMIT 1")
+    assert "the label" not in query
+    assert "'drop; --'" in query
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT count(*) AS do FROM event_event",
+    'SELECT "update" FROM event_event',
+    "SELECT e.lock FROM event_event e",
+    "SELECT label FROM event_event WHERE label = 'DELETE'",
+])
+def test_allows_keywords_in_aliases_identifiers_and_literals(query):
+    check_query(query)
+
+
+@pytest.mark.parametrize("query, reason", [
+    ("", "empty"),
+    ("-- nothing", "empty"),
+    ("SELECT 1; SELECT 2", "multiple_statements"),
+    ("UPDATE event_event SET label = 'x'", "not_select"),
+    ("WITH gone AS (DELETE FROM event_event RETURNING id) SELECT id FROM gone", "not_read_only"),
+    ("SELECT label INTO copy FROM event_event", "not_read_only"),
+    ("SELECT pg_sleep(10)", "not_read_only"),
+    ("SELECT * FROM event_event", "select_star"),
+    ("SELECT e.* FROM event_event e", "select_star"),
+    ("SELECT a.label FROM event_event a, event_event b", "cross_join"),
+    ("SELECT a.label FROM event_event a CROSS JOIN event_event b", "cross_join"),
+])
+def test_rejects(query, reason):
+    assert rejected(query) == reason
+
+
+def test_feedback_carries_reason_and_hint():
+    with pytest.raises(QueryRejected) as excinfo:
+        check_query("SELECT * FROM event_event")
+    feedback = excinfo.value.feedback()
+    assert feedback["rejected"] is True
+    assert feedback["reason"] == "select_star"
+    assert feedback["hint"]
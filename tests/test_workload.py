@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pytest
+
+from workload import DB_TABLE_NAME, fingerprint, normalize, parse_interval, suggest_indexes
+
+
+def test_normalize_replaces_literals_and_comments():
+    assert normalize(
+        "SELECT label FROM event_event -- recent\nWHERE label = 'PERSON' AND score > 0.5 LIMIT 10;"
+    ) == "select label from event_event where label = ? and score > ? limit ?"
+
+
+def test_normalize_collapses_in_lists():
+    assert normalize("SELECT id FROM t WHERE label IN ('a', 'b', 'c')") == normalize(
+        "select id from t where label in ('x')"
+    ) == "select id from t where label in (?)"
+
+
+def test_normalize_ignores_whitespace_and_case():
+    a = normalize("SELECT  label\n  FROM event_event /* x */ WHERE camera_name = 'door'")
+    b = normalize("select label from event_event where camera_name = 'garden'")
+    assert a == b
+    assert fingerprint(a) == fingerprint(b)
+
+
+def test_parse_interval():
+    assert parse_interval("30 days").days == 30
+    assert parse_interval("1 week 2 hours").total_seconds() == 7 * 86400 + 7200
+    assert parse_interval("1 year").days == 365
+
+
+NOW = datetime(2025, 5, 1, 13, 0)
+
+
+def test_partial_index_for_literal_start_time_bounds():
+    shape = normalize(
+        "SELECT label FROM event_event WHERE camera_name = 'door' "
+        "AND start_time >= '2025-04-20'::timestamptz ORDER BY start_time"
+    )
+    suggestions = suggest_indexes([{"shape": shape, "total_ms": 10.0}], now=NOW)
+    partial = suggestions[-1][1]
+    assert f"ON {DB_TABLE_NAME} (camera_name, start_time)" in partial
+    assert "_since_20250401_" in partial
+    assert "WHERE start_time >= '2025-04-01 00:00:00';" in partial
+    assert "DROP" not in partial
+
+
+@pytest.mark.parametrize("condition", [
+    "start_time >= now() - interval '1 day'",
+    "start_time >= CURRENT_DATE",
+    "start_time > '2025-04-20'::date - interval '1 day'",
+])
+def test_no_partial_index_for_non_immutable_bounds(condition):
+    shape = normalize(f"SELECT label FROM event_event WHERE label = 'PERSON' AND {condition}")
+    suggestions = suggest_indexes([{"shape": shape, "total_ms": 10.0}], now=NOW)
+    assert len(suggestions) == 1
+    assert "WHERE" not in suggestions[0][1]
+
+
+def test_suggest_indexes_without_shapes():
+    assert suggest_indexes([]) == []
@@ -0,0 +1,213 @@
+"""
+Wakeword model loading with tunable ONNX Runtime sessions.
+
+openwakeword creates its ONNX sessions with fixed options. build_model()
+replaces the wakeword, melspectrogram and embedding sessions with ones that use
+the configured thread counts and graph optimization level, and can load an
+int8-quantized wakeword model (see `python wakeword_bench.py quantize`).
+
+WakewordGate skips inference on blocks a cheap detector considers silent.
+"""
+import audioop
+import functools
+import os
+from collections import Counter, deque
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WAKEWORD_MODEL = os.getenv("WAKEWORD_MODEL", "./hey_jupiter.onnx")
+# One thread each keeps inference from competing with the event loop on the
+# hub's 4-core ARM boards; raise them on larger machines.
+WAKEWORD_INTRA_OP_THREADS = int(os.getenv("WAKEWORD_INTRA_OP_THREADS", "1"))
+WAKEWORD_INTER_OP_THREADS = int(os.getenv("WAKEWORD_INTER_OP_THREADS", "1"))
+# disabled | basic | extended | all
+WAKEWORD_GRAPH_OPTIMIZATION = os.getenv("WAKEWORD_GRAPH_OPTIMIZATION", "all").lower()
+
+# Skip wakeword inference while the room is quiet: off | energy | vad
+WAKEWORD_GATE = os.getenv("WAKEWORD_GATE", "off").lower()
+# RMS level (PCM16) above which a block counts as sound in "energy" mode.
+WAKEWORD_GATE_RMS = int(os.getenv("WAKEWORD_GATE_RMS", "300"))
+# Blocks that keep being scored after the detector last fired, so the tail of
+# a phrase is not cut off.
+WAKEWORD_GATE_HANGOVER_BLOCKS = int(os.getenv("WAKEWORD_GATE_HANGOVER_BLOCKS", "12"))
+# Skipped blocks kept and fed to the model when the gate opens. By default the
+# lookback covers everything the model needs before its first valid score (see
+# lookback_blocks_for), so the first scored block sees the same features it
+# would have without gating.
+WAKEWORD_GATE_LOOKBACK_BLOCKS = int(os.getenv("WAKEWORD_GATE_LOOKBACK_BLOCKS", "0")) or None
+
+# openwakeword's feature pipeline per 1280-sample (80 ms) block: 8 melspectrogram
+# frames; one embedding per block from a window of 76 frames; and each wakeword
+# model scores a window of model_inputs[name] (typically 16) embeddings.
+MEL_FRAMES_PER_BLOCK = 8
+EMBEDDING_WINDOW_FRAMES = 76
+
+_OPTIMIZATION_LEVELS = {
+    "disabled": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+
+def _session(path, intra_op_threads, inter_op_threads, optimization):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.graph_optimization_level = getattr(ort.GraphOptimizationLevel, _OPTIMIZATION_LEVELS[optimization])
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def _run(session, x):
+    return session.run(None, {session.get_inputs()[0].name: x})
+
+
+def build_model(
+    model_path=None,
+    intra_op_threads=None,
+    inter_op_threads=None,
+    optimization=None,
+    download=True,
+):
+    """
+    Build an openwakeword Model whose ONNX sessions use the given settings
+    (defaults: the WAKEWORD_* environment variables). A thread count of 0 lets
+    ONNX Runtime choose.
+    """
+    import openwakeword
+    import openwakeword.utils
+
+    model_path = model_path or WAKEWORD_MODEL
+    # 0 is a valid thread count (ONNX Runtime's own default), so only None falls back.
+    if intra_op_threads is None:
+        intra_op_threads = WAKEWORD_INTRA_OP_THREADS
+    if inter_op_threads is None:
+        inter_op_threads = WAKEWORD_INTER_OP_THREADS
+    optimization = optimization or WAKEWORD_GRAPH_OPTIMIZATION
+    if optimization not in _OPTIMIZATION_LEVELS:
+        raise ValueError(f"Unknown graph optimization level {optimization!r}, expected one of {list(_OPTIMIZATION_LEVELS)}")
+
+    if download:
+        openwakeword.utils.download_models()
+    model = openwakeword.Model(wakeword_models=[model_path], inference_framework="onnx")
+    session = functools.partial(
+        _session,
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=inter_op_threads,
+        optimization=optimization,
+    )
+
+    for name in model.models:
+        model.models[name] = session(model_path)
+        model.model_prediction_function[name] = functools.partial(_run, model.models[name])
+
+    # The feature extractor's lambdas look the sessions up on the instance,
+    # so replacing the attributes is enough.
+    resources = os.path.join(os.path.dirname(openwakeword.__file__), "resources", "models")
+    model.preprocessor.melspec_model = session(os.path.join(resources, "melspectrogram.onnx"))
+    model.preprocessor.embedding_model = session(os.path.join(resources, "embedding_model.onnx"))
+    return model
+
+
+def lookback_blocks_for(model):
+    """
+    Blocks of audio the model needs before its first valid score: enough to
+    fill the first embedding window, then one block per embedding in the
+    largest wakeword model input (16 + 9 = 25 for the bundled models).
+    """
+    embedding_blocks = -(-(EMBEDDING_WINDOW_FRAMES - MEL_FRAMES_PER_BLOCK) // MEL_FRAMES_PER_BLOCK)
+    return max(model.model_inputs.values()) + embedding_blocks
+
+
+@functools.lru_cache
+def get_wakeword_model():
+    """The shared wakeword model, built on first use with the WAKEWORD_* settings."""
+    print(
+        f"Loading wakeword model {WAKEWORD_MODEL} (intra_op={WAKEWORD_INTRA_OP_THREADS}, "
+        f"inter_op={WAKEWORD_INTER_OP_THREADS}, optimization={WAKEWORD_GRAPH_OPTIMIZATION})"
+    )
+    return build_model()
+
+
+class WakewordGate:
+    """
+    Runs the wakeword model on PCM16 blocks, skipping blocks that the energy
+    or VAD detector reports as silence. Skipped blocks are kept in a lookback
+    ring and fed to the model together with the block that opens the gate,
+    which refills openwakeword's melspectrogram and embedding buffers with the
+    audio that preceded the sound.
+    """
+    def __init__(
+        self,
+        model,
+        threshold,
+        sample_rate,
+        mode=None,
+        rms_threshold=WAKEWORD_GATE_RMS,
+        hangover_blocks=WAKEWORD_GATE_HANGOVER_BLOCKS,
+        lookback_blocks=WAKEWORD_GATE_LOOKBACK_BLOCKS,
+    ):
+        self.model = model
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.mode = mode or WAKEWORD_GATE
+        if self.mode not in ("off", "energy", "vad"):
+            raise ValueError(f"Unknown wakeword gate {self.mode!r}, expected off, energy or vad")
+        self.rms_threshold = rms_threshold
+        self.hangover_blocks = hangover_blocks
+        self._hangover = 0
+        if lookback_blocks is None:
+            lookback_blocks = lookback_blocks_for(model)
+        self._lookback = deque(maxlen=lookback_blocks)
+        if self.mode == "vad":
+            import webrtcvad
+            self._vad = webrtcvad.Vad(1)
+            # webrtcvad takes 10, 20 or 30 ms frames; 20 ms fits in one block.
+            self._vad_frame_bytes = sample_rate * 20 // 1000 * 2
+        # scored / skipped / replayed blocks, gate openings
+        self.counters = Counter()
+
+    def _sound(self, pcm):
+        if self.mode == "energy":
+            return audioop.rms(pcm, 2) > self.rms_threshold
+        frame = pcm[:self._vad_frame_bytes]
+        return len(frame) == self._vad_frame_bytes and self._vad.is_speech(frame, self.sample_rate)
+
+    def score(self, pcm):
+        """Feed one block of PCM16 bytes; returns True if the wakeword fired."""
+        if self.mode != "off":
+            if self._sound(pcm):
+                self._hangover = self.hangover_blocks
+            elif self._hangover > 0:
+                self._hangover -= 1
+            else:
+                self._lookback.append(bytes(pcm))
+                self.counters["skipped"] += 1
+                return False
+
+        if self._lookback:
+            self.counters["gate_openings"] += 1
+            self.counters["replayed"] += len(self._lookback)
+            pcm = b"".join(self._lookback) + bytes(pcm)
+            self._lookback.clear()
+        self.counters["scored"] += 1
+        self.model.predict(np.frombuffer(pcm, dtype=np.int16))
+        return any(buf and buf[-1] > self.threshold for buf in self.model.prediction_buffer.values())
+
+    def reset(self):
+        self._hangover = 0
+        self._lookback.clear()
+        self.model.reset()
+
+    def stats(self):
+        blocks = self.counters["scored"] + self.counters["skipped"]
+        return {
+            "mode": self.mode,
+            **self.counters,
+            "skipped_share": self.counters["skipped"] / blocks if blocks else None,
+        }
@@ -0,0 +1,224 @@
+"""
+Wakeword inference tuning: quantize the model, check its accuracy and
+benchmark inference settings.
+
+    python wakeword_bench.py quantize [--output hey_jupiter.int8.onnx]
+    python wakeword_bench.py check --samples samples/ [--quantized hey_jupiter.int8.onnx]
+    python wakeword_bench.py bench [--audio recording.wav] [--models a.onnx,b.onnx]
+                                   [--threads 1,2,4] [--optimization basic,all]
+    python wakeword_bench.py gate --samples samples/ [--modes off,energy,vad]
+
+`check` and `gate` expect recorded wav files under samples/positive/ (the wake
+phrase) and samples/negative/ (everything else). Audio is fed to the model the way
+AudioManager does: mono PCM16 at RATE in CHUNK_SAMPLES blocks.
+"""
+import argparse
+import audioop
+import glob
+import itertools
+import os
+import time
+import wave
+
+import numpy as np
+
+from audio_manager import CHUNK_SAMPLES, RATE, WAKE_THRESHOLD
+from wakeword import WAKEWORD_MODEL, WakewordGate, build_model
+
+
+def load_wav(path):
+    """Read a wav file as mono PCM16 at RATE."""
+    with wave.open(path, "rb") as wav:
+        pcm = wav.readframes(wav.getnframes())
+        if wav.getsampwidth() != 2:
+            pcm = audioop.lin2lin(pcm, wav.getsampwidth(), 2)
+        if wav.getnchannels() == 2:
+            pcm = audioop.tomono(pcm, 2, 0.5, 0.5)
+        if wav.getframerate() != RATE:
+            pcm, _ = audioop.ratecv(pcm, 2, 1, wav.getframerate(), RATE, None)
+    return np.frombuffer(pcm, dtype=np.int16)
+
+
+def blocks(samples):
+    for i in range(0, len(samples) - CHUNK_SAMPLES + 1, CHUNK_SAMPLES):
+        yield samples[i:i + CHUNK_SAMPLES]
+
+
+def max_score(model, samples):
+    """Highest wakeword score over a clip, from a clean model state."""
+    model.reset()
+    best = 0.0
+    for block in blocks(samples):
+        model.predict(block)
+        best = max([best] + [buf[-1] for buf in model.prediction_buffer.values() if buf])
+    return best
+
+
+def load_clips(samples_dir):
+    return {
+        label: sorted(glob.glob(os.path.join(samples_dir, label, "*.wav")))
+        for label in ("positive", "negative")
+    }
+
+
+def first_detection(gate, samples):
+    """Index of the first block the wakeword fires on (None if never), from a clean state."""
+    gate.reset()
+    for index, block in enumerate(blocks(samples)):
+        if gate.score(block.tobytes()):
+            return index
+    return None
+
+
+def compare_gates(samples_dir, modes):
+    """
+    Replay the clips through each gate mode and compare detections, detection
+    delay against ungated scoring, blocks skipped and inference CPU time.
+    """
+    clips = load_clips(samples_dir)
+    if not any(clips.values()):
+        print(f"No wav files under {samples_dir}/positive or {samples_dir}/negative")
+        return
+    block_ms = CHUNK_SAMPLES * 1000 / RATE
+    model = build_model()
+    audio = {path: load_wav(path) for paths in clips.values() for path in paths}
+    reference = {path: first_detection(WakewordGate(model, WAKE_THRESHOLD, RATE, mode="off"), samples)
+                 for path, samples in audio.items()}
+
+    print(f"Threshold {WAKE_THRESHOLD}, {len(clips['positive'])} positive / {len(clips['negative'])} negative clips\n")
+    print(f"{'mode':>7} {'recall':>7} {'fp':>4} {'missed':>7} {'delay ms':>9} {'skipped':>8} {'cpu s':>7}")
+    for mode in modes:
+        gate = WakewordGate(model, WAKE_THRESHOLD, RATE, mode=mode)
+        detected = {label: 0 for label in clips}
+        missed = 0
+        delays = []
+        cpu_seconds = 0.0
+        for label, paths in clips.items():
+            for path in paths:
+                started = time.process_time()
+                index = first_detection(gate, audio[path])
+                cpu_seconds += time.process_time() - started
+                detected[label] += index is not None
+                if reference[path] is not None:
+                    if index is None:
+                        missed += 1
+                    else:
+                        delays.append((index - reference[path]) * block_ms)
+        # counters accumulate across clips; reset() only clears audio state
+        stats = gate.stats()
+        recall = detected["positive"] / len(clips["positive"]) if clips["positive"] else float("nan")
+        print(f"{mode:>7} {recall:7.1%} {detected['negative']:4d} {missed:7d} "
+              f"{np.mean(delays) if delays else 0.0:9.1f} {stats['skipped_share'] or 0.0:8.1%} {cpu_seconds:7.2f}")
+    print("\nmissed: clips the ungated model detects but this mode does not; "
+          "delay: mean detection delay against ungated scoring")
+
+
+def quantize(model_path, output):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(model_path, output, weight_type=QuantType.QInt8)
+    print(f"{model_path} ({os.path.getsize(model_path)} bytes) -> {output} ({os.path.getsize(output)} bytes)")
+
+
+def check(samples_dir, model_path, quantized_path):
+    """Compare detections and scores of the reference and quantized models per clip."""
+    clips = load_clips(samples_dir)
+    if not any(clips.values()):
+        print(f"No wav files under {samples_dir}/positive or {samples_dir}/negative")
+        return
+
+    models = {"reference": build_model(model_path), "quantized": build_model(quantized_path, download=False)}
+    detected = {(name, label): 0 for name in models for label in clips}
+    disagreements = []
+    score_diffs = []
+    for label, paths in clips.items():
+        for path in paths:
+            samples = load_wav(path)
+            scores = {name: max_score(model, samples) for name, model in models.items()}
+            for name, score in scores.items():
+                detected[name, label] += score > WAKE_THRESHOLD
+            score_diffs.append(abs(scores["reference"] - scores["quantized"]))
+            if (scores["reference"] > WAKE_THRESHOLD) != (scores["quantized"] > WAKE_THRESHOLD):
+                disagreements.append((path, scores))
+
+    print(f"Threshold {WAKE_THRESHOLD}, {len(clips['positive'])} positive / {len(clips['negative'])} negative clips")
+    for name in models:
+        recall = detected[name, "positive"] / len(clips["positive"]) if clips["positive"] else None
+        false_positives = detected[name, "negative"]
+        print(f"{name:>10}: recall {recall if recall is None else f'{recall:.1%}'}, false positives {false_positives}")
+    print(f"Score difference: mean {np.mean(score_diffs):.4f}, max {np.max(score_diffs):.4f}")
+    for path, scores in disagreements:
+        print(f"  disagree {path}: reference {scores['reference']:.3f}, quantized {scores['quantized']:.3f}")
+
+
+def bench(samples, model_paths, threads, optimizations, warmup=20):
+    """Per-block latency and CPU share of inference for every combination of settings."""
+    audio_seconds = len(samples) / RATE
+    print(f"{audio_seconds:.1f} s of audio, {len(samples) // CHUNK_SAMPLES} blocks of {CHUNK_SAMPLES} samples\n")
+    print(f"{'model':<28} {'threads':>7} {'optim':>9} {'p50 ms':>7} {'p95 ms':>7} {'max ms':>7} {'cpu %':>6}")
+    for model_path, thread_count, optimization in itertools.product(model_paths, threads, optimizations):
+        model = build_model(model_path, thread_count, 1, optimization)
+        for block in itertools.islice(blocks(samples), warmup):
+            model.predict(block)
+        model.reset()
+
+        latencies = []
+        cpu_started = time.process_time()
+        for block in blocks(samples):
+            started = time.perf_counter()
+            model.predict(block)
+            latencies.append((time.perf_counter() - started) * 1000)
+        cpu_seconds = time.process_time() - cpu_started
+
+        # CPU share: inference CPU time as a fraction of the audio's real time,
+        # i.e. how much of one core the detector takes while streaming.
+        print(f"{os.path.basename(model_path):<28} {thread_count:>7} {optimization:>9} "
+              f"{np.percentile(latencies, 50):7.2f} {np.percentile(latencies, 95):7.2f} "
+              f"{max(latencies):7.2f} {cpu_seconds / audio_seconds * 100:6.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize, check and benchmark the wakeword model.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    quantize_parser = subparsers.add_parser("quantize", help="write an int8-quantized copy of the model")
+    quantize_parser.add_argument("--model", default=WAKEWORD_MODEL)
+    quantize_parser.add_argument("--output", default="hey_jupiter.int8.onnx")
+
+    check_parser = subparsers.add_parser("check", help="compare the quantized model on recorded samples")
+    check_parser.add_argument("--samples", required=True, help="directory with positive/ and negative/ wav files")
+    check_parser.add_argument("--model", default=WAKEWORD_MODEL)
+    check_parser.add_argument("--quantized", default="hey_jupiter.int8.onnx")
+
+    bench_parser = subparsers.add_parser("bench", help="per-block latency and CPU share per configuration")
+    bench_parser.add_argument("--audio", help="wav file to replay (default: 30 s of low-level noise)")
+    bench_parser.add_argument("--models", default=WAKEWORD_MODEL, help="comma-separated model paths")
+    bench_parser.add_argument("--threads", default="1,2,4", help="comma-separated intra-op thread counts (0: ONNX Runtime default)")
+    bench_parser.add_argument("--optimization", default="basic,all", help="comma-separated graph optimization levels")
+
+    gate_parser = subparsers.add_parser("gate", help="compare wakeword gate modes on replayed samples")
+    gate_parser.add_argument("--samples", required=True, help="directory with positive/ and negative/ wav files")
+    gate_parser.add_argument("--modes", default="off,energy,vad", help="comma-separated gate modes")
+
+    args = parser.parse_args()
+    if args.command == "quantize":
+        quantize(args.model, args.output)
+    elif args.command == "check":
+        check(args.samples, args.model, args.quantized)
+    elif args.command == "gate":
+        compare_gates(args.samples, args.modes.split(","))
+    elif args.command == "bench":
+        if args.audio:
+            samples = load_wav(args.audio)
+        else:
+            samples = np.random.default_rng(0).normal(0, 300, RATE * 30).astype(np.int16)
+        bench(
+            samples,
+            args.models.split(","),
+            [int(t) for t in args.threads.split(",")],
+            args.optimization.split(","),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,31 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from audio_manager import AudioManager
+from audio_manager import RECORD_ON_WAKE, get_audio_manager
+import asyncio
 import os
 import uvicorn
 from fastapi import FastAPI, Request, UploadFile, File
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import json
-import base64
 from datetime import datetime, time, timedelta
 
 # Import your existing code
-from openai_socket import connect_to_openai, request_response, single_interaction
+from openai_socket import (
+    cancel_response,
+    connect_to_openai,
+    request_response,
+    send_user_audio,
+    send_user_message,
+    single_interaction,
+    tool_stats,
+    watch_barge_in,
+)
 from state import State
+from conversation_context import context
+import answer_cache
+import intent_router
+import result_encoder
+import sql_guard
 
 from dotenv import load_dotenv
 
@@ -32,7 +46,9 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"Failed to connect to OpenAI: {e}")
         websocket = None
+    barge_in_task = asyncio.create_task(watch_barge_in(lambda: websocket))
     yield
+    barge_in_task.cancel()
     if websocket:
         # await websocket.close()
         try:
@@ -89,7 +105,6 @@ async def record_and_ask():
     then send the recorded audio to the LLM.
     """
     from recording import record_voice_input  # your existing recording function
-    import base64
 
     if not await ensure_connection():
         return JSONResponse({"answer": "I'm having trouble connecting to the assistant service. Please try again."})
@@ -97,22 +112,12 @@ async def record_and_ask():
     recorded_audio = await record_voice_input()
     if recorded_audio is None:
         return JSONResponse({"skip": True})
-    encoded_audio = base64.b64encode(recorded_audio).decode('utf-8')
 
     state = State()
-    state.pcm_data = b""
+    state.begin_turn("record")
 
     try:
-        await websocket.send(json.dumps({
-             'type': 'conversation.item.create',
-             'item': {
-                 'type': 'message',
-                 'role': 'user',
-                 'content': [
-                     {'type': 'input_audio', 'audio': encoded_audio}
-                 ]
-             }
-        }))
+        await send_user_audio(websocket, recorded_audio)
         await request_response(websocket)
         await single_interaction(websocket)
     except Exception as e:
@@ -120,16 +125,21 @@ async def record_and_ask():
         # websocket = None
         return JSONResponse({"answer": "Connection lost. Please try again."})
         
-    current_text = state.text.strip()
-    state.text += "\n 1-------------------------------------------------- \n"
+    current_text = state.end_turn()
+    if state.turn_cancelled:
+        return JSONResponse({"answer": current_text, "cancelled": True})
     return JSONResponse({"answer": current_text})
 
 
 @app.websocket("/ws/wakeword")
 async def wakeword_ws(ws: WebSocket):
     await ws.accept()
-    audio = AudioManager()
+    audio = get_audio_manager()
     try:
+        if audio is None:
+            # headless: no wakeword will ever fire, just hold the socket open
+            while True:
+                await ws.receive_text()
         while True:
             await audio.wake_event.wait()
             await ws.send_json({"wakeword": True})
@@ -137,36 +147,202 @@ async def wakeword_ws(ws: WebSocket):
     except WebSocketDisconnect:
         return
 
+@app.websocket("/ws/converse")
+async def converse_ws(ws: WebSocket):
+    """
+    Persistent, full-duplex conversation channel used by the UI.
+
+    Client -> server:
+      {"type": "text", "text": "..."}      ask a text question
+      {"type": "summary"}                  ask for the SUMMARY_TIMEFRAME summary
+      {"type": "record"}                   record from the hub microphone and ask
+      {"type": "audio", "audio": "<b64>"}  append a PCM16 chunk to the input buffer
+      {"type": "audio_commit"}             ask using the appended audio
+      {"type": "cancel"}                   cancel the turn in progress
+
+    Server -> client:
+      {"type": "wakeword", "recording": bool}  (recording: the server already started the voice turn)
+      {"type": "status", "status": "listening|thinking|done|skipped|cancelled|busy|error"}
+      {"type": "transcript", "delta": "..."}
+      {"type": "media", "media_paths": [...]}
+      {"type": "answer", "text": "..."}
+    """
+    from recording import record_voice_input
+
+    await ws.accept()
+    audio = get_audio_manager()
+    send_lock = asyncio.Lock()
+    turn = None
+
+    async def push(event):
+        async with send_lock:
+            await ws.send_json(event)
+
+    async def watch_wakeword():
+        nonlocal turn
+        if audio is None:
+            return
+        while True:
+            await audio.wake_event.wait()
+            audio.wake_event.clear()
+            await push({"type": "wakeword", "recording": RECORD_ON_WAKE})
+            if RECORD_ON_WAKE:
+                # The audio thread already started recording at the wakeword;
+                # take the turn over here instead of waiting for the client.
+                await cancel_turn()
+                turn = asyncio.create_task(run_turn(send_recording, "record"))
+
+    async def send_recording():
+        await push({"type": "status", "status": "listening"})
+        recorded_audio = await record_voice_input()
+        if recorded_audio is None:
+            return False
+        await send_user_audio(websocket, recorded_audio)
+        return True
+
+    async def run_turn(send_input, kind, question="", text_only=False, model_turn=False, cache_key=None):
+        state = State()
+        state.begin_turn(kind, question)
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        if not await ensure_connection():
+            await push({"type": "answer", "text": "I'm having trouble connecting to the assistant service. Please try again."})
+            await push({"type": "status", "status": "error"})
+            return
+        try:
+            if not await send_input():
+                await push({"type": "status", "status": "skipped"})
+                return
+            await push({"type": "status", "status": "thinking"})
+            await request_response(websocket)
+            await single_interaction(websocket, text_only=text_only, on_event=push)
+        except (asyncio.CancelledError, WebSocketDisconnect):
+            raise
+        except Exception as e:
+            print(f"Connection error: {e}")
+            await push({"type": "answer", "text": "Connection lost. Please try again."})
+            await push({"type": "status", "status": "error"})
+            return
+        if state.turn_cancelled:
+            # barge-in: the answer is partial, so it is neither cached nor timed
+            await push({"type": "answer", "text": state.end_turn()})
+            await push({"type": "status", "status": "cancelled"})
+            return
+        if model_turn:
+            intent_router.record_model_turn((loop.time() - started_at) * 1000)
+        answer_cache.store(cache_key)
+        await push({"type": "answer", "text": state.end_turn()})
+        await push({"type": "status", "status": "done"})
+
+    async def cancel_turn():
+        if turn is None or turn.done():
+            return
+        turn.cancel()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            pass
+        if websocket is not None:
+            await cancel_response(websocket)
+        await push({"type": "status", "status": "cancelled"})
+
+    wake_task = asyncio.create_task(watch_wakeword())
+    try:
+        while True:
+            msg = await ws.receive_json()
+            kind = msg.get("type")
+
+            if kind == "cancel":
+                await cancel_turn()
+                continue
+            if kind == "audio":
+                if websocket is not None:
+                    await websocket.send(json.dumps({
+                        'type': 'input_audio_buffer.append',
+                        'audio': msg.get("audio", ""),
+                    }))
+                    context.audio_appended(msg.get("audio", ""))
+                continue
+            if turn is not None and not turn.done():
+                await push({"type": "status", "status": "busy"})
+                continue
+
+            if kind == "text":
+                user_text = msg.get("text", "").strip()
+                if not user_text:
+                    await push({"type": "answer", "text": "No text received."})
+                    continue
+                answer = await asyncio.to_thread(intent_router.route, user_text)
+                if answer is not None:
+                    await push({"type": "answer", "text": answer})
+                    await push({"type": "status", "status": "done"})
+                    continue
+                key, cached = await lookup_answer(user_text)
+                if cached is not None:
+                    await push_cached(push, cached)
+                    continue
+
+                async def send_text(user_text=user_text):
+                    await send_user_message(websocket, [{'type': 'input_text', 'text': user_text}])
+                    return True
+                turn = asyncio.create_task(run_turn(send_text, "ask", user_text, model_turn=True, cache_key=key))
+            elif kind == "summary":
+                key, cached = await lookup_answer(summary_cache_question(), play_audio=False)
+                if cached is not None:
+                    await push_cached(push, cached)
+                    continue
+
+                async def send_summary():
+                    await send_user_message(websocket, [{'type': 'input_text', 'text': build_summary_query()}])
+                    return True
+                turn = asyncio.create_task(run_turn(send_summary, "summary", text_only=True, cache_key=key))
+            elif kind == "record":
+                turn = asyncio.create_task(run_turn(send_recording, "record"))
+            elif kind == "audio_commit":
+                async def commit_audio():
+                    await websocket.send(json.dumps({'type': 'input_audio_buffer.commit'}))
+                    context.audio_committed()
+                    return True
+                turn = asyncio.create_task(run_turn(commit_audio, "audio"))
+            else:
+                await push({"type": "status", "status": "error", "detail": f"Unknown message type: {kind}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        wake_task.cancel()
+        if turn is not None and not turn.done():
+            turn.cancel()
+
 @app.post("/ask")
 async def ask_question(request: Request):
     """
     Handle text queries.
     """
     global websocket
-    if not await ensure_connection():
-        return JSONResponse({"answer": "I'm having trouble connecting to the assistant service. Please try again."})
-    
     data = await request.json()
     user_text = data.get("text", "")
     if not user_text:
         return JSONResponse({"answer": "No text received."})
 
+    # Common questions are answered from the database without the model round trip.
+    answer = await asyncio.to_thread(intent_router.route, user_text)
+    if answer is not None:
+        return JSONResponse({"answer": answer})
+    key, cached = await lookup_answer(user_text)
+    if cached is not None:
+        return JSONResponse({"answer": cached.text})
+
+    if not await ensure_connection():
+        return JSONResponse({"answer": "I'm having trouble connecting to the assistant service. Please try again."})
+
     state = State()
-    state.pcm_data = b""
-    state.reset()
+    state.begin_turn("ask", user_text)
     print('Start ask_question')
+    loop = asyncio.get_running_loop()
+    started_at = loop.time()
     try:
         print(f"Received user text: {user_text}")
-        await websocket.send(json.dumps({
-            'type': 'conversation.item.create',
-            'item': {
-                'type': 'message',
-                'role': 'user',
-                'content': [
-                    {'type': 'input_text', 'text': user_text}
-                ]
-            }
-        }))
+        await send_user_message(websocket, [{'type': 'input_text', 'text': user_text}])
         print(f"Sent user text to WebSocket: {user_text}")
         await request_response(websocket)
         print(f"request_response: {user_text}")
@@ -177,11 +353,122 @@ async def ask_question(request: Request):
         print(f"Connection error: {e}")
         # websocket = None
         return JSONResponse({"answer": "Connection lost. Please try again."})
+    if state.turn_cancelled:
+        return JSONResponse({"answer": state.end_turn(), "cancelled": True})
+    intent_router.record_model_turn((loop.time() - started_at) * 1000)
+    answer_cache.store(key)
 
-    current_text = state.text.strip()
-    state.text += "\n 2-------------------------------------------------- \n"
+    current_text = state.end_turn()
     return JSONResponse({"answer": current_text})
 
+async def lookup_answer(question, play_audio=True):
+    """
+    Look `question` up in the answer cache. Returns (key, entry); on a hit the
+    entry's media paths are restored and its audio replayed. The key needs the
+    data version from the database, so it is built in a thread.
+    """
+    if not answer_cache.cache.enabled:
+        return None, None
+    key = await asyncio.to_thread(answer_cache.cache.key, question)
+    cached = answer_cache.cache.get(key)
+    if cached is not None:
+        print(f"Answer cache hit: {question}")
+        answer_cache.replay(cached, play_audio=play_audio)
+    return key, cached
+
+async def push_cached(push, cached):
+    if cached.media_paths:
+        await push({"type": "media", "media_paths": cached.media_paths})
+    await push({"type": "answer", "text": cached.text})
+    await push({"type": "status", "status": "done"})
+
+def sse(event):
+    """Format one event as a Server-Sent Events frame."""
+    return f"data: {json.dumps(event, default=str)}\n\n"
+
+async def stream_local_answer(answer, source):
+    """SSE frames for an answer produced without the model ("intent" or "cache")."""
+    yield sse({"type": "transcript", "delta": answer})
+    yield sse({"type": "done", "answer": answer, "ttft_ms": 0, "total_ms": 0, "source": source})
+
+async def stream_turn(user_text, kind, text_only=False, model_turn=False, cache_key=None):
+    """
+    Send a text question and yield SSE frames for the transcript deltas as they
+    arrive, followed by a final "done" frame carrying the full answer and the
+    time to first token ("cancelled" instead, with the partial answer, when the
+    response was cancelled).
+    """
+    state = State()
+    state.begin_turn(kind, user_text)
+
+    if not await ensure_connection():
+        yield sse({"type": "error", "text": "I'm having trouble connecting to the assistant service. Please try again."})
+        return
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    async def run():
+        try:
+            await send_user_message(websocket, [{'type': 'input_text', 'text': user_text}])
+            await request_response(websocket)
+            await single_interaction(websocket, text_only=text_only, on_event=events.put)
+            answer_cache.store(cache_key)
+        except Exception as e:
+            print(f"Connection error: {e}")
+            await events.put({"type": "error", "text": "Connection lost. Please try again."})
+        finally:
+            await events.put(None)
+
+    started_at = loop.time()
+    first_token_at = None
+    task = asyncio.create_task(run())
+    try:
+        while (event := await events.get()) is not None:
+            if first_token_at is None and event["type"] == "transcript":
+                first_token_at = loop.time()
+            yield sse(event)
+    finally:
+        if not task.done():
+            task.cancel()
+
+    finished_at = loop.time()
+    ttft_ms = round((first_token_at - started_at) * 1000) if first_token_at else None
+    total_ms = round((finished_at - started_at) * 1000)
+    print(f"Streamed answer: time to first token {ttft_ms} ms, total {total_ms} ms")
+    if state.turn_cancelled:
+        yield sse({"type": "cancelled", "answer": state.end_turn(), "ttft_ms": ttft_ms, "total_ms": total_ms})
+        return
+    if model_turn:
+        intent_router.record_model_turn(total_ms)
+    yield sse({"type": "done", "answer": state.end_turn(), "ttft_ms": ttft_ms, "total_ms": total_ms})
+
+def sse_response(frames):
+    return StreamingResponse(
+        frames,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.post("/ask/stream")
+async def ask_question_stream(request: Request):
+    """
+    Streaming variant of /ask: Server-Sent Events with one "transcript" event per
+    delta and a final "done" event ({"answer", "ttft_ms", "total_ms"}).
+    """
+    data = await request.json()
+    user_text = data.get("text", "")
+    if not user_text:
+        return JSONResponse({"answer": "No text received."})
+    print(f"Received user text (stream): {user_text}")
+    answer = await asyncio.to_thread(intent_router.route, user_text)
+    if answer is not None:
+        return sse_response(stream_local_answer(answer, "intent"))
+    key, cached = await lookup_answer(user_text)
+    if cached is not None:
+        return sse_response(stream_local_answer(cached.text, "cache"))
+    return sse_response(stream_turn(user_text, "ask", model_turn=True, cache_key=key))
+
 @app.post("/ask_audio")
 async def ask_audio(file: UploadFile = File(...)):
     """
@@ -189,52 +476,54 @@ async def ask_audio(file: UploadFile = File(...)):
     """
     global websocket
     audio_bytes = await file.read()
-    encoded_audio = base64.b64encode(audio_bytes).decode('utf-8')
 
     state = State()
-    state.pcm_data = b""
-
-    await websocket.send(json.dumps({
-         'type': 'conversation.item.create',
-         'item': {
-             'type': 'message',
-             'role': 'user',
-             'content': [
-                 {'type': 'input_audio', 'audio': encoded_audio}
-             ]
-         }
-    }))
+    state.begin_turn("audio")
+
+    await send_user_audio(websocket, audio_bytes)
     await request_response(websocket)
     await single_interaction(websocket)
 
-    current_text = state.text.strip()
-    state.text += "\n 3-------------------------------------------------- \n"
+    current_text = state.end_turn()
+    if state.turn_cancelled:
+        return JSONResponse({"answer": current_text, "cancelled": True})
     return JSONResponse({"answer": current_text})
 
 
 @app.get("/media_paths")
 async def get_media_paths():
     """
-    Returns the last retrieved media paths.
+    Returns the media paths retrieved during the current (or last finished) turn.
     This endpoint is intended for use by the UI only.
     """
     state = State()
     if not state.last_media_paths:
         return JSONResponse({"error": "No media paths retrieved yet."})
-    # Optionally, once fetched you can clear the state.
     media_data = state.last_media_paths
 
     return JSONResponse({"media_paths": media_data})
 
-@app.get("/summary")
-async def summary():
+@app.get("/stats")
+async def get_stats():
     """
-    Returns a summary of the important events within the last 24 hours.
-    The endpoint calculates the start (24 hours ago) and current date/time,
-    formats them into words, and then sends a text query to the LLM to summarize events.
+    Runtime counters for monitoring.
+    """
+    audio = get_audio_manager(create=False)
+    return JSONResponse({
+        "sql_guard": sql_guard.stats(),
+        "tool_output": result_encoder.stats(),
+        "tool_calls": tool_stats(),
+        "intent_router": intent_router.stats(),
+        "answer_cache": answer_cache.cache.stats(),
+        "memory": State().memory_stats(),
+        "wakeword": await audio.wakeword_stats() if audio is not None else None,
+        "context": context.stats(),
+    })
+
+def build_summary_query():
+    """
+    Build the summary prompt for the configured SUMMARY_TIMEFRAME.
     """
-    if not await ensure_connection():
-        return JSONResponse({"summary": "I'm having trouble connecting to the assistant service. Please try again."})
     timeframe = os.getenv("SUMMARY_TIMEFRAME", "daily").lower()
     now = datetime.now()
 
@@ -261,33 +550,58 @@ async def summary():
         f"Please provide a summary of the important events from {start} to {end}. "
         f"Only include major events that would be relevant to a smart home assistant user."
     )
+    return summary_query
+
+
+def summary_cache_question():
+    """
+    Cache question for the summary. The prompt itself contains timestamps, so
+    it is keyed by timeframe and day instead; new events change the data version.
+    """
+    timeframe = os.getenv("SUMMARY_TIMEFRAME", "daily").lower()
+    return f"summary {timeframe} {datetime.now().date()}"
+
+
+@app.get("/summary")
+async def summary():
+    """
+    Returns a summary of the important events within the last 24 hours.
+    The endpoint calculates the start (24 hours ago) and current date/time,
+    formats them into words, and then sends a text query to the LLM to summarize events.
+    """
+    key, cached = await lookup_answer(summary_cache_question(), play_audio=False)
+    if cached is not None:
+        return JSONResponse({"summary": cached.text})
+    if not await ensure_connection():
+        return JSONResponse({"summary": "I'm having trouble connecting to the assistant service. Please try again."})
+    summary_query = build_summary_query()
 
     state = State()
-    state.pcm_data = b""
-    state.reset()
-    state.text = ""
-    state.last_media_paths = []
+    state.begin_turn("summary")
     try:
     # Send the summary query to the LLM
-        await websocket.send(json.dumps({
-            'type': 'conversation.item.create',
-            'item': {
-                'type': 'message',
-                'role': 'user',
-                'content': [
-                    {'type': 'input_text', 'text': summary_query }
-                ]
-            }
-        }))
+        await send_user_message(websocket, [{'type': 'input_text', 'text': summary_query}])
         await request_response(websocket)
         await single_interaction(websocket, text_only=True)
     except Exception as e:
         print(f"Connection error: {e}")
         # websocket = None
         return JSONResponse({"summary": "Connection lost. Please try again."})
-    summary_answer = state.text.strip()
-    state.text += "\n 4-------------------------------------------------- \n"
+    answer_cache.store(key)
+    summary_answer = state.end_turn()
+    if state.turn_cancelled:
+        return JSONResponse({"summary": summary_answer, "cancelled": True})
     return JSONResponse({"summary": summary_answer})
 
+@app.get("/summary/stream")
+async def summary_stream():
+    """
+    Streaming variant of /summary, using the same event format as /ask/stream.
+    """
+    key, cached = await lookup_answer(summary_cache_question(), play_audio=False)
+    if cached is not None:
+        return sse_response(stream_local_answer(cached.text, "cache"))
+    return sse_response(stream_turn(build_summary_query(), "summary", text_only=True, cache_key=key))
+
 if __name__ == "__main__":
     uvicorn.run("web_demo:app", host="0.0.0.0", port=8000, reload=True)
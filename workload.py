@@ -0,0 +1,227 @@
+"""
+Query workload recorder and index advisor for the events table.
+
+query_database() calls record_query() for every statement it executes. Each
+statement is stored in a local SQLite file as a normalized fingerprint (literals
+replaced by ?), its duration, the number of rows returned and the plan summary
+from sql_guard.check_plan. Only the most recent WORKLOAD_MAX_ROWS statements
+are kept.
+
+Report the slowest and most frequent query shapes and suggested indexes:
+    python workload.py report [--top 10]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WORKLOAD_DB = os.getenv("WORKLOAD_DB", "workload.sqlite3")
+WORKLOAD_MAX_ROWS = int(os.getenv("WORKLOAD_MAX_ROWS", "10000"))
+DB_TABLE_NAME = os.getenv("DB_TABLE_NAME", "event_event")
+DATA_TIME_WINDOW = os.getenv("DATA_TIME_WINDOW", "30 days")
+
+# Columns of the events table the advisor will consider for indexes.
+EVENT_COLUMNS = (
+    "event_id", "label", "sub_label", "start_time", "end_time", "camera_name",
+    "confidence_score", "title", "loitering", "parcel_status", "vehicle_status",
+)
+
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\bin\s*\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_COLUMNS = "|".join(EVENT_COLUMNS)
+_EQUALITY = re.compile(rf"\b({_COLUMNS})\s*(?:=|\bin\b|\blike\b|\bilike\b|\bis\b)")
+_RANGE = re.compile(rf"\b({_COLUMNS})\s*(?:>=|<=|>|<|\bbetween\b)")
+_ORDER_BY = re.compile(rf"\border\s+by\s+({_COLUMNS})\b")
+# start_time compared with a plain (possibly cast) literal, not now() - interval ?
+_START_TIME_LITERAL = re.compile(r"\bstart_time\s*(?:>=?|\bbetween\b)\s*\?(?:\s*::\s*\w+\b)?(?!\s*[-+*/:])")
+_INTERVAL_PART = re.compile(r"(\d+(?:\.\d+)?)\s*(year|month|week|day|hour|minute|min|second|sec)s?\b", re.I)
+# PostgreSQL truncates longer identifiers
+MAX_IDENTIFIER_LENGTH = 63
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recorded_at REAL NOT NULL,
+    fingerprint TEXT NOT NULL,
+    shape TEXT NOT NULL,
+    duration_ms REAL NOT NULL,
+    rows INTEGER NOT NULL,
+    plan TEXT
+)
+"""
+
+
+def normalize(query):
+    """Reduce a statement to its shape: no comments or literals, lower case, single spaces."""
+    shape = _COMMENTS.sub(" ", query)
+    shape = _LITERALS.sub("?", shape)
+    shape = " ".join(shape.split()).lower().rstrip(";").strip()
+    return _IN_LISTS.sub("in (?)", shape)
+
+
+def fingerprint(shape):
+    return hashlib.sha1(shape.encode()).hexdigest()[:12]
+
+
+def _connect():
+    connection = sqlite3.connect(WORKLOAD_DB)
+    connection.execute(_SCHEMA)
+    return connection
+
+
+def record_query(query, duration_ms, rows, plan=None):
+    """
+    Append one executed statement to the workload store. Never raises: a broken
+    recorder must not break the query path.
+    """
+    try:
+        shape = normalize(query)
+        connection = _connect()
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO queries (recorded_at, fingerprint, shape, duration_ms, rows, plan) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), fingerprint(shape), shape, duration_ms, rows, json.dumps(plan)),
+            )
+            # Rolling retention: drop everything older than the newest WORKLOAD_MAX_ROWS.
+            connection.execute("DELETE FROM queries WHERE id <= ?", (cursor.lastrowid - WORKLOAD_MAX_ROWS,))
+        connection.close()
+    except Exception as e:
+        print(f"Failed to record query workload: {e}")
+
+
+def load_shapes():
+    """Aggregate the recorded statements per fingerprint."""
+    connection = _connect()
+    records = connection.execute(
+        "SELECT fingerprint, shape, duration_ms, rows, plan FROM queries ORDER BY id"
+    ).fetchall()
+    connection.close()
+
+    shapes = {}
+    for fp, shape, duration_ms, rows, plan in records:
+        entry = shapes.setdefault(fp, {"fingerprint": fp, "shape": shape, "durations": [], "rows": 0, "seq_scans": 0})
+        entry["durations"].append(duration_ms)
+        entry["rows"] += rows
+        plan = json.loads(plan) if plan else None
+        if plan and plan.get("seq_scans"):
+            entry["seq_scans"] += 1
+
+    for entry in shapes.values():
+        durations = sorted(entry.pop("durations"))
+        entry["count"] = len(durations)
+        entry["total_ms"] = sum(durations)
+        entry["avg_ms"] = entry["total_ms"] / len(durations)
+        entry["p95_ms"] = durations[min(len(durations) - 1, int(len(durations) * 0.95))]
+        entry["max_ms"] = durations[-1]
+        entry["avg_rows"] = entry["rows"] / len(durations)
+    return list(shapes.values())
+
+
+def parse_interval(text):
+    """
+    Parse a PostgreSQL-style interval such as "30 days" or "1 week 2 hours" into
+    a timedelta. Months and years count as 30 and 365 days.
+    """
+    seconds = {"year": 365 * 86400, "month": 30 * 86400, "week": 7 * 86400, "day": 86400, "hour": 3600,
+               "minute": 60, "min": 60, "second": 1, "sec": 1}
+    parts = _INTERVAL_PART.findall(text)
+    if not parts:
+        raise ValueError(f"Unsupported interval {text!r}")
+    return timedelta(seconds=sum(float(value) * seconds[unit.lower()] for value, unit in parts))
+
+
+def suggest_indexes(shapes, now=None):
+    """
+    Suggest indexes from the columns the recorded shapes filter and sort on,
+    weighted by the total time spent in each shape. Equality columns lead and
+    range/sort columns (usually start_time) follow, as in a B-tree composite.
+
+    Shapes that bound start_time from below with a literal can also use a
+    partial index covering only the DATA_TIME_WINDOW the app can see (cutoff
+    computed from `now`); the heaviest of their column sets is suggested as one.
+    """
+    weights = defaultdict(float)
+    literal_weights = defaultdict(float)
+    for entry in shapes:
+        equality = tuple(sorted(set(_EQUALITY.findall(entry["shape"]))))
+        ordered = [c for c in _RANGE.findall(entry["shape"]) + _ORDER_BY.findall(entry["shape"]) if c not in equality]
+        ordered = tuple(dict.fromkeys(ordered))
+        columns = equality + ordered
+        if columns:
+            weights[columns] += entry["total_ms"]
+            if _START_TIME_LITERAL.search(entry["shape"]):
+                literal_weights[columns] += entry["total_ms"]
+
+    suggestions = []
+    for columns, total_ms in sorted(weights.items(), key=lambda item: item[1], reverse=True):
+        name = f"{DB_TABLE_NAME}_{'_'.join(columns)}_idx"
+        suggestions.append((total_ms, f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {DB_TABLE_NAME} ({', '.join(columns)});"))
+
+    # Partial index predicates must be immutable, so the cutoff is a literal
+    # timestamp. The planner only uses such an index when the query's own
+    # predicate implies it, which now() / CURRENT_DATE filters (including the
+    # DATA_TIME_WINDOW view's) never do: only literal start_time bounds count.
+    if literal_weights:
+        columns = max(literal_weights.items(), key=lambda item: item[1])[0]
+        cutoff = ((now or datetime.now()) - parse_interval(DATA_TIME_WINDOW)).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        name = f"{DB_TABLE_NAME}_since_{cutoff:%Y%m%d}_{'_'.join(columns)}"[:MAX_IDENTIFIER_LENGTH - 4] + "_idx"
+        suggestions.append((0.0, (
+            f"-- only used by queries whose literal start_time bound is on or after {cutoff:%Y-%m-%d}\n"
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} "
+            f"ON {DB_TABLE_NAME} ({', '.join(columns)}) "
+            f"WHERE start_time >= '{cutoff:%Y-%m-%d %H:%M:%S}';"
+        )))
+    return suggestions
+
+
+def report(top=10):
+    shapes = load_shapes()
+    if not shapes:
+        print(f"No queries recorded in {WORKLOAD_DB} yet.")
+        return
+
+    def print_shapes(title, ranked):
+        print(title)
+        print(f"{'count':>6} {'avg ms':>8} {'p95 ms':>8} {'max ms':>8} {'avg rows':>8} {'seq':>4}  shape")
+        for entry in ranked[:top]:
+            print(f"{entry['count']:6d} {entry['avg_ms']:8.1f} {entry['p95_ms']:8.1f} {entry['max_ms']:8.1f} "
+                  f"{entry['avg_rows']:8.1f} {entry['seq_scans']:4d}  [{entry['fingerprint']}] {entry['shape']}")
+        print()
+
+    total = sum(entry["count"] for entry in shapes)
+    print(f"{total} statements, {len(shapes)} distinct shapes in {WORKLOAD_DB}\n")
+    print_shapes("Slowest shapes (by average duration)", sorted(shapes, key=lambda e: e["avg_ms"], reverse=True))
+    print_shapes("Most frequent shapes", sorted(shapes, key=lambda e: e["count"], reverse=True))
+    print_shapes("Most total time", sorted(shapes, key=lambda e: e["total_ms"], reverse=True))
+
+    print("Suggested indexes (by total time of the shapes they serve)")
+    for total_ms, statement in suggest_indexes(shapes):
+        print(f"-- {total_ms:.0f} ms\n{statement}" if total_ms else statement)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query workload report and index advisor.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="rank query shapes and suggest indexes")
+    report_parser.add_argument("--top", type=int, default=10, help="number of shapes per ranking")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        report(args.top)
+
+
+if __name__ == "__main__":
+    main()